@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Cheap DSP gate in front of CLAP: skip the model on silent or low-activity windows.
+
+At night most windows are near-silent, but every window still paid the full model
+cost. The gate decides per window from features the DSP stage already computed:
+- dB SPL (from the RMS, as calculate_db_spl): below max_db_spl the window is silent,
+- spectral flatness (geometric / arithmetic mean of the power spectrum, 1 = white
+  noise, near 0 = tonal): steady noise is flat, voices, birds and sirens are not,
+- band ratio: the share of the energy in the band where those events live.
+A window quieter than quiet_db_spl is only gated when it is also flat and has
+little energy in the band, so quiet but structured sounds still reach the model.
+
+Gated windows get a synthetic result with "Silence" on top, so the published
+message keeps its format and still carries the measured levels.
+"""
+
+import numpy as np
+
+SILENCE_LABEL = "Silence"
+FLATNESS_FLOOR = 1e-10  # power floor before the log, as librosa.feature.spectral_flatness
+
+
+class ActivityGate:
+    """Decides per window whether CLAP has to run, and counts the decisions."""
+
+    def __init__(
+        self,
+        max_db_spl=35.0,
+        quiet_db_spl=45.0,
+        min_flatness=0.3,
+        band=(300.0, 8000.0),
+        max_band_ratio=0.5,
+        sample_rate=48000,
+        n_fft=1024,
+    ):
+        self.max_db_spl = max_db_spl  # always gated below this level
+        self.quiet_db_spl = quiet_db_spl  # gated below this level if flat and off-band
+        self.min_flatness = min_flatness
+        self.max_band_ratio = max_band_ratio
+        bin_hz = sample_rate / n_fft
+        self.band_bins = slice(int(band[0] / bin_hz), int(np.ceil(band[1] / bin_hz)) + 1)
+        self.counts = {"windows": 0, "silent": 0, "low_activity": 0}
+
+    def measure(self, power, db_spl):
+        """Gate features of one (frames, frequency bins) power spectrogram"""
+        power = np.maximum(power, FLATNESS_FLOOR)
+        geometric = np.exp(np.mean(np.log(power), axis=-1))
+        flatness = float(np.mean(geometric / np.mean(power, axis=-1)))
+        total = float(np.sum(power))
+        band_ratio = float(np.sum(power[:, self.band_bins])) / total
+        return {"db_spl": float(db_spl), "flatness": flatness, "band_ratio": band_ratio}
+
+    def check(self, power, db_spl):
+        """(gated, reason, measures) of one window; reason is None when CLAP has to run"""
+        if db_spl < self.max_db_spl:
+            reason = "silent"
+            measures = {"db_spl": float(db_spl)}  # the spectrum does not matter
+        else:
+            measures = self.measure(power, db_spl) if db_spl < self.quiet_db_spl else {}
+            if (
+                measures
+                and measures["flatness"] >= self.min_flatness
+                and measures["band_ratio"] <= self.max_band_ratio
+            ):
+                reason = "low_activity"
+            else:
+                reason = None
+        self.counts["windows"] += 1
+        if reason is not None:
+            self.counts[reason] += 1
+        return reason is not None, reason, measures
+
+    def hit_rate(self):
+        """Fraction of the windows that did not need the model"""
+        windows = self.counts["windows"]
+        return (self.counts["silent"] + self.counts["low_activity"]) / windows if windows else 0.0
+
+    def stats(self):
+        return {**self.counts, "hit_rate": self.hit_rate()}
+
+
+def synthetic_result(labels):
+    """Ranked result of a gated window: SILENCE_LABEL with score 1, the others 0"""
+    others = [label for label in labels if label != SILENCE_LABEL]
+    return [{"score": 1.0, "label": SILENCE_LABEL}] + [
+        {"score": 0.0, "label": label} for label in others
+    ]
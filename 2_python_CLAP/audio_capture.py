@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Gapless audio capture with one persistent input stream and a ring buffer.
+
+sd.rec() + sd.wait() opens a new recording for every window, so the audio between
+two recordings is lost and the start times drift. Here one sd.InputStream stays
+open; its callback copies every block into a preallocated ring buffer. Windows are
+cut on exact sample boundaries (window n is samples n * W ... (n + 1) * W - 1), so
+consecutive windows have no gap and no overlap. With hop_samples smaller than the
+window, window n starts at sample n * hop_samples instead, so consecutive windows
+overlap by window_samples - hop_samples (sliding-window streaming). Each window is
+still copied out of the ring in full, overlap included: queued windows are
+processed independently and each needs its own samples. The overlap is only
+reused in the STFT frames (see spectral_features.StreamingFeatureStage).
+
+The start time of a window is taken from the stream clock: the ADC time of the
+first sample plus the sample offset, converted to wall-clock time once at startup.
+
+With a BufferPool the windows are read into a fixed set of preallocated buffers
+that go back to the pool after processing, so the steady state allocates no audio
+memory. Capture in int16 halves the ring and pool memory.
+"""
+
+import datetime
+import queue
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+
+class RingBufferCapture:
+    """Continuous mono capture, read as windows of window_samples every hop_samples."""
+
+    def __init__(
+        self,
+        sample_rate=48000,
+        window_samples=480000,
+        capacity_windows=3,
+        device=None,
+        blocksize=0,
+        dtype="float32",
+        hop_samples=None,
+    ):
+        self.sample_rate = sample_rate
+        self.window_samples = window_samples
+        self.hop_samples = hop_samples or window_samples
+        self.capacity = capacity_windows * window_samples
+        self.dtype = np.dtype(dtype)  # "float32" or "int16"
+        self.ring = np.zeros(self.capacity, dtype=self.dtype)
+        self.written = 0  # samples written since the start, only grows
+        self.read = 0  # first sample of the next window
+        self.condition = threading.Condition()
+        self.first_sample_time = None  # stream clock time of sample 0
+        self.clock_offset = None  # wall-clock time minus stream clock time
+        self.input_overflows = 0  # blocks the driver dropped before the callback
+        self.lost_samples = 0  # samples overwritten before they were read
+        self.stream = sd.InputStream(
+            samplerate=sample_rate,
+            channels=1,
+            dtype=self.dtype.name,
+            blocksize=blocksize,
+            device=device,
+            callback=self.callback,
+        )
+
+    def callback(self, indata, frames, time_info, status):
+        """Copy one block into the ring buffer (runs in the audio thread)"""
+        if status.input_overflow:
+            self.input_overflows += 1
+        if self.first_sample_time is None:
+            # Some ALSA devices report 0 for the ADC time, use the callback time then
+            self.first_sample_time = time_info.inputBufferAdcTime or time_info.currentTime
+        start = self.written % self.capacity
+        first = min(frames, self.capacity - start)
+        self.ring[start : start + first] = indata[:first, 0]
+        self.ring[: frames - first] = indata[first:, 0]
+        with self.condition:
+            self.written += frames
+            self.condition.notify_all()
+
+    def start(self):
+        """Open the stream, from now on every sample ends up in a window"""
+        self.stream.start()
+        self.clock_offset = time.time() - self.stream.time
+
+    def stop(self):
+        """Stop and close the stream"""
+        self.stream.stop()
+        self.stream.close()
+        with self.condition:
+            self.condition.notify_all()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def window_start_time(self, first_sample):
+        """Wall-clock start time of a sample, from the stream clock"""
+        stream_time = self.first_sample_time + first_sample / self.sample_rate
+        return datetime.datetime.fromtimestamp(self.clock_offset + stream_time)
+
+    def wait_for(self, end, timeout=None):
+        """Wait until sample end - 1 has been written, returns False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.written >= end, timeout)
+
+    def read_samples(self, first_sample, count, out=None):
+        """Copy samples first_sample ... first_sample + count - 1, None if no longer in the ring
+
+        For extra readers next to read_window, such as the onset detector. The
+        samples must have been written already (see wait_for).
+        """
+        if self.written - first_sample > self.capacity:
+            return None
+        if out is None:
+            out = np.empty(count, dtype=self.dtype)
+        start = first_sample % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.ring[start : start + first]
+        out[first:count] = self.ring[: count - first]
+        return out
+
+    def read_window(self, timeout=None, out=None):
+        """Wait for the next complete window, returns (start_time, samples) or None on timeout
+
+        All window_samples are copied, into out when given, otherwise into a new
+        array; with a hop the overlap with the previous window is copied again.
+        """
+        if not self.wait_for(self.read + self.window_samples, timeout):
+            return None
+        behind = self.written - self.read
+        if behind > self.capacity:
+            # The reader fell more than the ring behind: skip to the oldest full window
+            skipped = (behind - self.capacity) // self.hop_samples + 1
+            self.lost_samples += skipped * self.hop_samples
+            print(f"Capture fell behind, {skipped} window(s) lost")
+            self.read += skipped * self.hop_samples
+
+        samples = self.read_samples(self.read, self.window_samples, out)
+        if samples is None:
+            return None  # overwritten while skipping, the next call skips again
+        start_time = self.window_start_time(self.read)
+        self.read += self.hop_samples
+        return start_time, samples
+
+
+class BufferPool:
+    """Fixed set of preallocated window buffers, handed out and returned in turn."""
+
+    def __init__(self, count, window_samples, dtype="float32"):
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(np.zeros(window_samples, dtype=dtype))
+
+    def acquire(self, timeout=None):
+        """A free buffer, or None when none was returned within timeout"""
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, buffer):
+        """Return a buffer that is no longer used"""
+        self.free.put(buffer)
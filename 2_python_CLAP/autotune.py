@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Autotune the classifier settings for this host (Raspberry Pi or x86 box).
+
+Runs the classifier on synthetic windows and on recorded windows from the samples
+folder (urban_sounds_v3.x.py with SAVE_RECORDING = True) for a grid of settings:
+torch intra-op threads, inter-op threads, batch size and backend. For every setting
+it measures latency, throughput, CPU temperature and RSS. The best setting that
+keeps up with real time is written to a per-host profile
+(clap_classifier.HOST_PROFILE), which urban_sounds_v3.7.py loads at startup.
+
+At most (number of cores - RESERVED_CORES) threads are tried, so the recording
+thread always has a core of its own. Every thread setting runs in a fresh process,
+because torch only accepts the inter-op thread count once per process.
+"""
+
+import datetime
+import glob
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import time
+from re import findall
+from subprocess import check_output
+
+import numpy as np
+import soundfile as sf
+
+import sound_scapes
+from clap_classifier import (
+    HOST_PROFILE,
+    MODEL_NAME,
+    ClapLabelClassifier,
+    rss_mb,
+    synthetic_windows,
+)
+
+SAMPLE_RATE = 48000
+DURATION = 10  # seconds per window, as in urban_sounds_v3.7.py
+LABEL_EMBEDDINGS_FILE = "label_embeddings.npz"
+SAMPLES_FOLDER = "samples"  # recorded .wav files
+RESERVED_CORES = 1  # cores kept free for recording, DSP and MQTT
+INTEROP_THREADS = (1, 2)
+BATCH_SIZES = (1, 2, 4)
+BACKENDS = ("torch", "onnx")
+SYNTHETIC_WINDOWS = 4
+RECORDED_WINDOWS = 4
+REALTIME_MARGIN = 0.7  # a setting may use at most this fraction of DURATION per window
+COOLDOWN = 10  # seconds between trials, so earlier trials do not heat up later ones
+TRIAL_TIMEOUT = 1800  # seconds, a trial includes loading the model
+
+
+def get_cputemp():
+    """Get the CPU temperature of the Raspberry Pi, exception when run on other platforms"""
+    try:
+        temp = check_output(["vcgencmd", "measure_temp"]).decode("UTF-8")
+        return float(findall(r"\d+\.\d+", temp)[0])
+    except Exception as e:
+        print(f"{e}Cannot get temperature, this code is intended for Raspberry Pi.")
+
+
+def load_windows():
+    """Synthetic windows plus recorded windows, all DURATION seconds long"""
+    windows = synthetic_windows(SAMPLE_RATE, count=SYNTHETIC_WINDOWS, duration=DURATION)
+    window_samples = DURATION * SAMPLE_RATE
+    wav_files = sorted(glob.glob(os.path.join(SAMPLES_FOLDER, "*.wav")))
+    for wav_file in wav_files[-RECORDED_WINDOWS:]:
+        audio_data, sample_rate = sf.read(wav_file, dtype="float32")
+        if sample_rate != SAMPLE_RATE:
+            continue
+        audio_data = audio_data.reshape(len(audio_data), -1)[:, 0][:window_samples]
+        windows.append(np.pad(audio_data, (0, window_samples - len(audio_data))))
+    return windows
+
+
+def run_trial(backend, num_threads, interop_threads, results):
+    """Measure all batch sizes for one backend and thread setting (child process)"""
+    try:
+        classifier = ClapLabelClassifier.from_pretrained(
+            MODEL_NAME,
+            sound_scapes.marineterrein_labels,
+            audio_only=True,
+            embeddings_path=LABEL_EMBEDDINGS_FILE,
+            backend=backend,
+            num_threads=num_threads,
+            interop_threads=interop_threads,
+        )
+        classifier.warm_up(runs=1)
+        windows = load_windows()
+        measurements = []
+        for batch_size in BATCH_SIZES:
+            batch_latencies = []
+            start = time.perf_counter()
+            for i in range(0, len(windows), batch_size):
+                batch_start = time.perf_counter()
+                classifier.classify_batch(windows[i : i + batch_size])
+                batch_latencies.append(time.perf_counter() - batch_start)
+            total = time.perf_counter() - start
+            measurements.append(
+                {
+                    "backend": backend,
+                    "num_threads": num_threads,
+                    "interop_threads": interop_threads,
+                    "batch_size": batch_size,
+                    "latency_per_window_ms": total / len(windows) * 1000,
+                    "batch_latency_max_ms": max(batch_latencies) * 1000,
+                    "throughput": len(windows) / total,  # windows per second
+                    "cpu_temp": get_cputemp(),
+                    "rss_mb": rss_mb(),
+                }
+            )
+        results.put(measurements)
+    except Exception as e:
+        print(f"Trial {backend}/{num_threads}/{interop_threads} failed: {e}")
+        results.put([])
+
+
+def trial_settings():
+    """The grid of (backend, threads, interop threads) to try on this host"""
+    max_threads = max(1, (os.cpu_count() or 1) - RESERVED_CORES)
+    settings = []
+    for backend in BACKENDS:
+        if backend == "onnx":
+            try:
+                import onnxruntime  # noqa: F401
+            except ImportError:
+                print("onnxruntime not found, skipping the onnx backend")
+                continue
+        # ONNX Runtime runs the graph sequentially, inter-op threads do not apply
+        interop_options = INTEROP_THREADS if backend == "torch" else (1,)
+        for num_threads in range(1, max_threads + 1):
+            for interop_threads in interop_options:
+                settings.append((backend, num_threads, interop_threads))
+    return settings
+
+
+def choose_best(measurements):
+    """Highest throughput that keeps up with real time, ties go to fewer threads"""
+    budget_ms = DURATION * 1000 * REALTIME_MARGIN
+    feasible = [m for m in measurements if m["latency_per_window_ms"] < budget_ms]
+    if not feasible:
+        print("No setting keeps up with real time, using the fastest one")
+        feasible = measurements
+    return max(feasible, key=lambda m: (round(m["throughput"], 2), -m["num_threads"]))
+
+
+def main():
+    context = mp.get_context("spawn")
+    measurements = []
+    for backend, num_threads, interop_threads in trial_settings():
+        print(f"Trial: {backend}, {num_threads} threads, {interop_threads} interop")
+        results = context.Queue()
+        trial = context.Process(
+            target=run_trial, args=(backend, num_threads, interop_threads, results)
+        )
+        trial.start()
+        try:
+            trial_measurements = results.get(timeout=TRIAL_TIMEOUT)
+        except queue.Empty:
+            print("  trial timed out")
+            trial.terminate()
+            trial_measurements = []
+        trial.join()
+        for m in trial_measurements:
+            print(
+                f"  batch {m['batch_size']}: {m['latency_per_window_ms']:.0f} ms/window, "
+                f"{m['throughput']:.2f} windows/s, temp {m['cpu_temp']}, "
+                f"RSS {m['rss_mb']:.0f} MB"
+            )
+        measurements.extend(trial_measurements)
+        time.sleep(COOLDOWN)
+
+    if not measurements:
+        print("All trials failed, no profile written")
+        return
+    best = choose_best(measurements)
+    profile = {
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "backend": best["backend"],
+        "num_threads": best["num_threads"],
+        "interop_threads": best["interop_threads"],
+        "batch_size": best["batch_size"],
+        "best": best,
+        "trials": measurements,
+    }
+    os.makedirs(os.path.dirname(HOST_PROFILE), exist_ok=True)
+    with open(HOST_PROFILE, "w") as f:
+        json.dump(profile, f, indent=4)
+    print(
+        f"Best: {best['backend']}, {best['num_threads']} threads, "
+        f"{best['interop_threads']} interop, batch {best['batch_size']} "
+        f"({best['throughput']:.2f} windows/s). Profile written to {HOST_PROFILE}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Benchmark the precision modes of the CLAP audio encoder: fp32, int8 and bf16.
+
+For every mode the script measures the encoder latency, model size and RSS, and
+compares the classification with fp32 on our labelled clips: the UrbanSoundsSamples
+clips annotated in 1_test_CLAP_notebooks/annotations_20250704.json and the
+UrbanSoundsII dataset. It reports the top-1 match rate and the score deltas.
+
+The report is written to the cache folder (clap_classifier.PRECISION_REPORT).
+urban_sounds_v3.7.py only enables int8 or bf16 when the top-1 agreement of that
+mode in this report is at least PRECISION_MIN_AGREEMENT.
+"""
+
+import copy
+import datetime
+import io
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import torch
+from datasets import Audio, load_dataset
+
+import clap_torch
+import sound_scapes
+from clap_classifier import MODEL_NAME, PRECISION_REPORT, rss_mb, softmax
+
+SAMPLE_RATE = 48000
+WINDOW_SAMPLES = 10 * SAMPLE_RATE  # the classifier sees 10 s windows
+ANNOTATIONS_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..",
+    "1_test_CLAP_notebooks",
+    "annotations_20250704.json",
+)
+ANNOTATED_DATASET = "UrbanSounds/UrbanSoundsSamples"
+EXTRA_DATASETS = ["MichielBontenbal/UrbanSoundsII"]
+
+
+def load_clips():
+    """Load the labelled clips as (dataset name, 10 s float32 array) tuples"""
+    with open(ANNOTATIONS_FILE) as f:
+        annotations = json.load(f)
+    clips = []
+    dataset = load_dataset(ANNOTATED_DATASET, split="train")
+    dataset = dataset.cast_column("audio", Audio(sampling_rate=SAMPLE_RATE))
+    for index in annotations:
+        clips.append((ANNOTATED_DATASET, dataset[int(index)]["audio"]["array"]))
+    for name in EXTRA_DATASETS:
+        dataset = load_dataset(name, split="train")
+        dataset = dataset.cast_column("audio", Audio(sampling_rate=SAMPLE_RATE))
+        clips.extend((name, row["audio"]["array"]) for row in dataset)
+    # Crop to one window so the feature extractor never picks a random crop
+    return [
+        (name, np.asarray(a[:WINDOW_SAMPLES], dtype=np.float32)) for name, a in clips
+    ]
+
+
+def model_size_mb(module):
+    """Size of the serialized state dict in MB"""
+    buffer = io.BytesIO()
+    torch.save(module.state_dict(), buffer)
+    return buffer.tell() / 1024**2
+
+
+def run_mode(encoder, features, label_embeds, logit_scale):
+    """Classify all clips, returns (probabilities, latencies in seconds)"""
+    encoder(features[0])  # warm-up
+    probabilities = []
+    latencies = []
+    for input_features in features:
+        start = time.perf_counter()
+        audio_embeds = encoder(input_features)
+        latencies.append(time.perf_counter() - start)
+        probabilities.append(softmax(logit_scale * audio_embeds @ label_embeds.T)[0])
+    return np.array(probabilities), np.array(latencies)
+
+
+def agreement(probabilities, reference, mask=None):
+    """Top-1 match rate and score deltas of one mode against fp32"""
+    if mask is not None:
+        probabilities, reference = probabilities[mask], reference[mask]
+    top1 = np.argmax(reference, axis=1)
+    deltas = np.abs(probabilities - reference)
+    return {
+        "top1_agreement": float(np.mean(np.argmax(probabilities, axis=1) == top1)),
+        "mean_score_delta": float(np.mean(deltas)),
+        "max_score_delta": float(np.max(deltas)),
+        "top1_score_delta": float(
+            np.mean(deltas[np.arange(len(top1)), top1]) if len(top1) else 0.0
+        ),
+    }
+
+
+def main():
+    labels = sound_scapes.marineterrein_labels
+    clips = load_clips()
+    names = np.array([name for name, _ in clips])
+    print(f"Loaded {len(clips)} clips from {sorted(set(names))}")
+
+    model, processor = clap_torch.load_clap_model(MODEL_NAME)
+    label_embeds = clap_torch.encode_labels(model, processor.tokenizer, labels)
+    logit_scale = clap_torch.audio_logit_scale(model)
+    feature_extractor = processor.feature_extractor
+    features = [
+        feature_extractor(audio, sampling_rate=SAMPLE_RATE, return_tensors="np")[
+            "input_features"
+        ].astype(np.float32)
+        for _, audio in clips
+    ]
+    fp32_module = clap_torch.audio_encoder_from_model(model)
+
+    report = {
+        "model_name": MODEL_NAME,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "torch_threads": torch.get_num_threads(),
+        "clips": {name: int(np.sum(names == name)) for name in sorted(set(names))},
+        "modes": {},
+    }
+    reference = None
+    for precision in clap_torch.PRECISIONS:
+        module = fp32_module if precision == "fp32" else copy.deepcopy(fp32_module)
+        try:
+            clap_torch.apply_precision(module, precision)
+        except RuntimeError as e:
+            print(f"Skipping {precision}: {e}")
+            report["modes"][precision] = {"supported": False, "reason": str(e)}
+            continue
+
+        probabilities, latencies = run_mode(
+            clap_torch.TorchAudioEncoder(module), features, label_embeds, logit_scale
+        )
+        if reference is None:
+            reference = probabilities  # fp32 runs first
+        result = {
+            "supported": True,
+            "latency_mean_ms": float(np.mean(latencies) * 1000),
+            "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "model_size_mb": model_size_mb(module),
+            "rss_mb": rss_mb(),  # whole process, includes the fp32 reference
+        }
+        result.update(agreement(probabilities, reference))
+        result["per_dataset"] = {
+            name: agreement(probabilities, reference, names == name)
+            for name in sorted(set(names))
+        }
+        report["modes"][precision] = result
+        print(
+            f"{precision}: {result['latency_mean_ms']:.0f} ms/window "
+            f"(p95 {result['latency_p95_ms']:.0f} ms), "
+            f"model {result['model_size_mb']:.0f} MB, RSS {result['rss_mb']:.0f} MB, "
+            f"top-1 agreement {result['top1_agreement']:.3f}, "
+            f"max score delta {result['max_score_delta']:.4f}"
+        )
+        if module is not fp32_module:
+            del module
+
+    os.makedirs(os.path.dirname(PRECISION_REPORT), exist_ok=True)
+    with open(PRECISION_REPORT, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {PRECISION_REPORT}")
+
+
+if __name__ == "__main__":
+    main()
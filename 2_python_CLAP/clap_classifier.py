@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+"""
+Zero-shot CLAP audio classifier with cached label embeddings.
+
+The transformers zero-shot-audio-classification pipeline tokenizes and encodes
+every candidate label through the text tower on each call. The labels of a
+location (see sound_scapes.py) never change, so this classifier encodes them once
+at startup and per window only runs the audio encoder, one matmul and a softmax.
+The output has the same format as the pipeline: a list of {"score", "label"} dicts
+sorted from high to low score.
+
+In audio-only mode the label embeddings are saved to a .npz file and the text
+tower and tokenizer are freed. When a matching .npz file exists, the text side is
+never loaded at all.
+
+The audio encoder is a backend: "torch" runs the PyTorch model (clap_torch.py),
+"onnx" runs an exported copy on ONNX Runtime (clap_onnx.py) and "student" runs a
+small CNN distilled from the CLAP audio encoder (student_encoder.py). This module
+itself does not import torch, so the onnx backend runs without it once its files
+are cached. The transformers ClapFeatureExtractor imports torch, so the onnx
+backend computes the log-mel with ClapMelFrontend from the preprocessor_config.json
+of the model and only loads the extractor for its one-time setup.
+"""
+
+import ctypes
+import gc
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import psutil
+
+MODEL_NAME = "laion/larger_clap_general"
+# Same hypothesis template as the transformers zero-shot pipeline
+HYPOTHESIS_TEMPLATE = "This is a sound of {}."
+BACKENDS = ("torch", "onnx", "student")
+INPUT_SHAPE = (1, 1, 1001, 64)  # (batch, channels, frames, mel bands) for a 10 s window
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "urban_sounds")
+# Written by benchmark_precision.py, read before enabling int8 or bf16
+PRECISION_REPORT = os.path.join(CACHE_DIR, "precision_report.json")
+# Written by autotune.py: thread counts, batch size and backend for this host
+HOST_PROFILE = os.path.join(CACHE_DIR, f"profile_{platform.node()}.json")
+# Written by train_student.py, the distilled audio encoder of the student backend
+STUDENT_PATH = os.path.join(CACHE_DIR, "student_audio_encoder.pt")
+# Written by fit_embedding_pca.py, the PCA basis of the embedding uplink (copy it to the server)
+EMBEDDING_PCA_PATH = os.path.join(CACHE_DIR, "embedding_pca.npz")
+
+
+def softmax(logits):
+    """Numerically stable softmax over the last axis"""
+    logits = logits - np.max(logits, axis=-1, keepdims=True)
+    exp_logits = np.exp(logits)
+    return exp_logits / np.sum(exp_logits, axis=-1, keepdims=True)
+
+
+def normalize(embeddings):
+    """L2-normalize embeddings over the last axis"""
+    norm = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norm, 1e-12)
+
+
+def rss_mb():
+    """Resident memory of this process in MB"""
+    return psutil.Process().memory_info().rss / 1024**2
+
+
+def release_memory():
+    """Run the garbage collector and hand freed heap memory back to the OS (glibc only)"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def save_label_embeddings(path, model_name, labels, label_embeds, logit_scale):
+    """Store the encoded labels so a later start can skip the text tower"""
+    np.savez(
+        path,
+        model_name=np.array(model_name),
+        labels=np.array(labels),
+        label_embeds=label_embeds,
+        logit_scale=np.array(logit_scale),
+    )
+
+
+def load_label_embeddings(path, model_name, labels):
+    """Load encoded labels, returns (label_embeds, logit_scale) or None if stale or missing"""
+    if not path or not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        stale = str(saved["model_name"]) != model_name
+        stale = stale or saved["labels"].tolist() != list(labels)
+        if stale:
+            print(f"Label embeddings in {path} do not match the labels, re-encoding")
+            return None
+        return saved["label_embeds"], float(saved["logit_scale"])
+
+
+def precision_allowed(precision, model_name, report_path, min_agreement):
+    """Check the agreement report before enabling a reduced precision mode"""
+    if precision == "fp32":
+        return True
+    if not report_path or not os.path.exists(report_path):
+        print(f"No precision report at {report_path}, run benchmark_precision.py first")
+        return False
+    with open(report_path) as f:
+        report = json.load(f)
+    modes = report["modes"] if report["model_name"] == model_name else {}
+    mode = modes.get(precision)
+    if not mode or not mode.get("supported", True):
+        print(f"Precision {precision} was not benchmarked for {model_name}")
+        return False
+    if mode["top1_agreement"] < min_agreement:
+        print(
+            f"Refusing precision {precision}: top-1 agreement with fp32 is "
+            f"{mode['top1_agreement']:.3f} < {min_agreement}"
+        )
+        return False
+    return True
+
+
+def load_host_profile(path=HOST_PROFILE):
+    """Load the autotune profile of this host, returns None if there is none"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        profile = json.load(f)
+    print(
+        f"Host profile {path}: backend {profile['backend']}, "
+        f"{profile['num_threads']} threads, {profile['interop_threads']} interop "
+        f"threads, batch size {profile['batch_size']}"
+    )
+    return profile
+
+
+def synthetic_windows(sampling_rate, count=3, duration=10):
+    """Deterministic test windows (noise, tone and bursts) for checks and benchmarks"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(duration * sampling_rate)) / sampling_rate
+    windows = []
+    for i in range(count):
+        noise = 0.05 * rng.standard_normal(t.size)
+        tone = 0.2 * np.sin(2 * np.pi * (200 + 400 * i) * t)
+        gate = np.sin(2 * np.pi * 0.5 * (i + 1) * t) > 0.9
+        bursts = 0.3 * gate * rng.standard_normal(t.size)
+        windows.append((noise + tone + bursts).astype(np.float32))
+    return windows
+
+
+def encode_label_file(model_name, labels, embeddings_path):
+    """Encode the labels once with the full CLAP model, save them and free the model"""
+    import clap_torch
+
+    model, processor = clap_torch.load_clap_model(model_name)
+    label_embeds = clap_torch.encode_labels(model, processor.tokenizer, labels)
+    logit_scale = clap_torch.audio_logit_scale(model)
+    if embeddings_path:
+        save_label_embeddings(
+            embeddings_path, model_name, labels, label_embeds, logit_scale
+        )
+        print(f"Label embeddings saved to {embeddings_path}")
+    del model, processor
+    release_memory()
+    return label_embeds, logit_scale
+
+
+def load_feature_extractor(model_name):
+    """The transformers ClapFeatureExtractor of model_name (importing it loads torch)"""
+    from transformers import ClapFeatureExtractor
+
+    return ClapFeatureExtractor.from_pretrained(model_name)
+
+
+def load_preprocessor_config(model_name):
+    """The feature extractor settings of model_name, read without transformers"""
+    from huggingface_hub import hf_hub_download
+
+    with open(hf_hub_download(model_name, "preprocessor_config.json")) as f:
+        return json.load(f)
+
+
+def load_config_frontend(model_name):
+    """Log-mel front-end from the preprocessor config, None if it is not supported
+
+    No transformers or torch import; the front-end was checked against the
+    extractor when the onnx backend was set up.
+    """
+    from mel_frontend import ClapMelFrontend
+
+    try:
+        frontend = ClapMelFrontend.from_config(load_preprocessor_config(model_name))
+    except (ValueError, KeyError, OSError) as e:
+        print(f"Using the feature extractor for the log-mel input: {e}")
+        return None
+    print("Mel front-end loaded from the preprocessor config")
+    return frontend
+
+
+def load_mel_frontend(feature_extractor):
+    """Vectorized log-mel front-end, None if it does not match the feature extractor"""
+    from mel_frontend import ClapMelFrontend, validate
+
+    try:
+        frontend = ClapMelFrontend.from_feature_extractor(feature_extractor)
+        windows = synthetic_windows(feature_extractor.sampling_rate, count=2)
+        difference = validate(frontend, feature_extractor, windows)
+    except (ValueError, RuntimeError) as e:
+        print(f"Using the feature extractor for the log-mel input: {e}")
+        return None
+    print(f"Mel front-end matches the feature extractor ({difference:.5f} dB)")
+    return frontend
+
+
+def prepare_onnx_backend(
+    model_name, labels, embeddings_path, onnx_path, feature_extractor
+):
+    """One-time setup of the onnx backend with torch: encode labels, export, check parity"""
+    import clap_onnx
+    import clap_torch
+
+    model, processor = clap_torch.load_clap_model(model_name)
+    label_embeds = clap_torch.encode_labels(model, processor.tokenizer, labels)
+    logit_scale = clap_torch.audio_logit_scale(model)
+    if embeddings_path:
+        save_label_embeddings(
+            embeddings_path, model_name, labels, label_embeds, logit_scale
+        )
+        print(f"Label embeddings saved to {embeddings_path}")
+
+    audio_encoder = clap_torch.audio_encoder_from_model(model)
+    if not os.path.exists(onnx_path):
+        clap_onnx.export_audio_encoder(audio_encoder, onnx_path)
+    sampling_rate = feature_extractor.sampling_rate
+    input_features_list = [
+        feature_extractor(window, sampling_rate=sampling_rate, return_tensors="np")[
+            "input_features"
+        ]
+        for window in synthetic_windows(sampling_rate)
+    ]
+    try:
+        clap_onnx.check_parity(
+            clap_torch.TorchAudioEncoder(audio_encoder),
+            clap_onnx.OnnxAudioEncoder(onnx_path),
+            input_features_list,
+        )
+    except RuntimeError:
+        os.remove(onnx_path)  # export again at the next start
+        raise
+
+    del model, processor, audio_encoder
+    release_memory()
+    return label_embeds, logit_scale
+
+
+class ClapLabelClassifier:
+    """Zero-shot audio classifier that keeps the encoded labels in memory."""
+
+    def __init__(
+        self,
+        audio_encoder,
+        feature_extractor,
+        labels,
+        label_embeds,
+        logit_scale,
+        label_encoder=None,
+        frontend=None,
+    ):
+        # Callable: numpy input features -> normalized numpy embeddings
+        self.audio_encoder = audio_encoder
+        self.feature_extractor = feature_extractor
+        # Optional ClapMelFrontend, replaces the feature extractor for the log-mel;
+        # feature_extractor is None when the front-end comes from the config (onnx)
+        self.frontend = frontend
+        self.sampling_rate = (frontend or feature_extractor).sampling_rate
+        self.labels = list(labels)
+        self.label_embeds = label_embeds
+        # The pipeline scales logits_per_audio with the audio logit scale
+        self.logit_scale = logit_scale
+        self.label_encoder = label_encoder  # None when the text tower has been freed
+
+    @classmethod
+    def from_pretrained(
+        cls,
+        model_name=MODEL_NAME,
+        labels=(),
+        audio_only=False,
+        embeddings_path=None,
+        backend="torch",
+        cache_dir=CACHE_DIR,
+        precision="fp32",
+        min_agreement=0.95,
+        precision_report=PRECISION_REPORT,
+        engine="eager",
+        num_threads=None,
+        interop_threads=None,
+        student_path=STUDENT_PATH,
+        mel_frontend=True,
+        batch_size=1,
+    ):
+        """Load the CLAP model and encode the labels once.
+
+        With audio_only=True only the audio encoder stays in memory. If
+        embeddings_path holds embeddings for the same model and labels, only the
+        audio model is loaded from the checkpoint. The onnx backend is always
+        audio-only; its first start exports the encoder to cache_dir.
+
+        The torch backend can run the audio encoder in int8 or bf16. Such a mode
+        only activates when precision_report shows a top-1 agreement with fp32 of
+        at least min_agreement, otherwise the classifier falls back to fp32.
+        With engine "torchscript" or "inductor" the torch audio encoder is compiled
+        once for the fixed mel shape and the artifact is cached in cache_dir;
+        batch_size is the largest batch it will get.
+        num_threads and interop_threads limit the threads of torch or ONNX Runtime
+        (None keeps the library default), see autotune.py.
+        The student backend loads the distilled encoder from student_path (see
+        train_student.py) and, like onnx, is always audio-only.
+        With mel_frontend=True the log-mel input is computed by the vectorized
+        ClapMelFrontend when it matches the feature extractor at startup. The
+        onnx backend then builds it from the preprocessor config instead, so
+        neither transformers nor torch is imported once its files are cached.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, choose from {BACKENDS}")
+        if precision != "fp32" and backend != "torch":
+            print(f"Precision {precision} is only available for the torch backend")
+            precision = "fp32"
+        if not precision_allowed(
+            precision, model_name, precision_report, min_agreement
+        ):
+            precision = "fp32"
+        print(f"RSS before loading {model_name}: {rss_mb():.0f} MB")
+        saved = None
+        if audio_only or backend != "torch":
+            saved = load_label_embeddings(embeddings_path, model_name, labels)
+
+        if backend == "onnx":
+            import clap_onnx
+
+            onnx_path = clap_onnx.default_onnx_path(cache_dir, model_name)
+            feature_extractor, frontend = None, None
+            if saved is None or not os.path.exists(onnx_path):
+                # The one-time setup needs torch anyway
+                feature_extractor = load_feature_extractor(model_name)
+                saved = prepare_onnx_backend(
+                    model_name, labels, embeddings_path, onnx_path, feature_extractor
+                )
+                frontend = load_mel_frontend(feature_extractor) if mel_frontend else None
+            elif mel_frontend:
+                frontend = load_config_frontend(model_name)
+            if frontend is None and feature_extractor is None:
+                feature_extractor = load_feature_extractor(model_name)
+            audio_encoder = clap_onnx.OnnxAudioEncoder(onnx_path, num_threads)
+            print(f"RSS with the ONNX audio encoder: {rss_mb():.0f} MB")
+            return cls(
+                audio_encoder, feature_extractor, labels, *saved, frontend=frontend
+            )
+
+        import clap_torch
+
+        clap_torch.set_threads(num_threads, interop_threads)
+        feature_extractor = load_feature_extractor(model_name)
+        frontend = load_mel_frontend(feature_extractor) if mel_frontend else None
+
+        if backend == "student":
+            from student_encoder import load_student
+
+            if not os.path.exists(student_path):
+                raise FileNotFoundError(
+                    f"No student encoder at {student_path}, run train_student.py first"
+                )
+            if saved is None:
+                saved = encode_label_file(model_name, labels, embeddings_path)
+            audio_encoder = clap_torch.TorchAudioEncoder(load_student(student_path))
+            print(f"RSS with the student audio encoder: {rss_mb():.0f} MB")
+            return cls(
+                audio_encoder, feature_extractor, labels, *saved, frontend=frontend
+            )
+
+        def torch_audio_encoder(module):
+            module_precision = precision
+            try:
+                clap_torch.apply_precision(module, precision)
+                print(f"Audio encoder precision: {precision}")
+            except RuntimeError as e:
+                print(f"Cannot use precision {precision}: {e}, using fp32")
+                module_precision = "fp32"
+            artifact_path = clap_torch.default_engine_path(
+                cache_dir, model_name, module_precision, engine
+            )
+            return clap_torch.compile_audio_encoder(
+                module, engine, artifact_path, batch_size
+            )
+
+        if saved is not None:
+            label_embeds, logit_scale = saved
+            audio_encoder = clap_torch.load_audio_encoder(model_name)
+            release_memory()
+            print(f"Labels loaded from {embeddings_path}")
+            print(f"RSS with the audio model only: {rss_mb():.0f} MB")
+            return cls(
+                torch_audio_encoder(audio_encoder),
+                feature_extractor,
+                labels,
+                label_embeds,
+                logit_scale,
+                frontend=frontend,
+            )
+
+        model, processor = clap_torch.load_clap_model(model_name)
+        label_embeds = clap_torch.encode_labels(model, processor.tokenizer, labels)
+        logit_scale = clap_torch.audio_logit_scale(model)
+        audio_encoder = torch_audio_encoder(clap_torch.audio_encoder_from_model(model))
+        print(f"RSS with full CLAP model: {rss_mb():.0f} MB")
+        if embeddings_path:
+            save_label_embeddings(
+                embeddings_path, model_name, labels, label_embeds, logit_scale
+            )
+            print(f"Label embeddings saved to {embeddings_path}")
+
+        if not audio_only:
+            tokenizer = processor.tokenizer
+            return cls(
+                audio_encoder,
+                feature_extractor,
+                labels,
+                label_embeds,
+                logit_scale,
+                label_encoder=lambda new_labels: clap_torch.encode_labels(
+                    model, tokenizer, new_labels
+                ),
+                frontend=frontend,
+            )
+
+        # Drop the text tower, its embeddings and the tokenizer
+        del model, processor
+        release_memory()
+        print(f"RSS after freeing the text tower: {rss_mb():.0f} MB")
+        return cls(
+            audio_encoder,
+            feature_extractor,
+            labels,
+            label_embeds,
+            logit_scale,
+            frontend=frontend,
+        )
+
+    def set_labels(self, labels):
+        """Replace the label set and recompute the label matrix"""
+        if self.label_encoder is None:
+            raise RuntimeError("Cannot encode new labels in audio-only mode")
+        self.labels = list(labels)
+        self.label_embeds = self.label_encoder(self.labels)
+
+    def warm_up(self, runs=3):
+        """Run a synthetic window through the classifier and log the latencies"""
+        window = synthetic_windows(self.sampling_rate, count=1)[0]
+        latencies = []
+        for _ in range(runs + 1):
+            start = time.perf_counter()
+            self.embed_audio(window)
+            latencies.append(time.perf_counter() - start)
+        first, steady = latencies[0], float(np.median(latencies[1:]))
+        print(
+            f"Warm-up: first inference {first * 1000:.0f} ms, "
+            f"steady state {steady * 1000:.0f} ms"
+        )
+        eager_latency = getattr(self.audio_encoder, "eager_latency", None)
+        if eager_latency:
+            print(
+                f"Eager mode encoder: first inference {eager_latency[0] * 1000:.0f} ms, "
+                f"steady state {eager_latency[1] * 1000:.0f} ms"
+            )
+        return first, steady
+
+    def extract_features(self, audio_data):
+        """Compute the CLAP log-mel input features of one window or a list of windows"""
+        if self.frontend is not None:
+            return self.frontend(audio_data)
+        inputs = self.feature_extractor(
+            audio_data, sampling_rate=self.sampling_rate, return_tensors="np"
+        )
+        input_features = inputs["input_features"].astype(np.float32, copy=False)
+        return input_features, inputs["is_longer"]
+
+    def embed_audio(self, audio_data):
+        """Run only the audio encoder, returns normalized (windows, dim) embeddings"""
+        input_features, is_longer = self.extract_features(audio_data)
+        return self.audio_encoder(input_features, is_longer)
+
+    def score_embeddings(self, audio_embeds):
+        """Turn normalized audio embeddings into label probabilities"""
+        logits = self.logit_scale * audio_embeds @ self.label_embeds.T
+        return softmax(logits)
+
+    def ranked_result(self, scores):
+        """Pipeline-style result: {"score", "label"} dicts sorted from high to low"""
+        result = [
+            {"score": score, "label": label}
+            for score, label in zip(scores.tolist(), self.labels)
+        ]
+        return sorted(result, key=lambda x: -x["score"])
+
+    def __call__(self, audio_data, candidate_labels=None):
+        """Classify one audio window, same call signature and output as the pipeline."""
+        if candidate_labels is not None and list(candidate_labels) != self.labels:
+            self.set_labels(candidate_labels)
+        return self.ranked_result(
+            self.score_embeddings(self.embed_audio(audio_data))[0]
+        )
+
+    def classify_features(self, input_features, is_longer=None, return_embeddings=False):
+        """Classify precomputed log-mel features (see spectral_features.py)
+
+        With return_embeddings, returns (results, audio embeddings) instead.
+        """
+        audio_embeds = self.audio_encoder(input_features, is_longer)
+        scores = self.score_embeddings(audio_embeds)
+        results = [self.ranked_result(window_scores) for window_scores in scores]
+        return (results, audio_embeds) if return_embeddings else results
+
+    def classify_batch(self, audio_windows, candidate_labels=None):
+        """Classify several windows with one feature extraction and encoder call"""
+        if candidate_labels is not None and list(candidate_labels) != self.labels:
+            self.set_labels(candidate_labels)
+        scores = self.score_embeddings(self.embed_audio(list(audio_windows)))
+        return [self.ranked_result(window_scores) for window_scores in scores]
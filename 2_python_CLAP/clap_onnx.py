@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+ONNX Runtime backend for the CLAP (HTSAT) audio encoder.
+
+The audio encoder always gets a (1, 1, 1001, 64) log-mel input for a 10 s window
+(see 1_test_CLAP_notebooks/clap_audio_model). The encoder and audio projection are
+exported once to an .onnx file in the cache folder, after which inference runs on
+the ONNX Runtime CPU execution provider. Torch is only imported for the one-time
+export and the parity check, not in the per-window path.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from clap_classifier import INPUT_SHAPE
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+OPSET_VERSION = 17
+# Minimum cosine similarity between ONNX and PyTorch embeddings
+PARITY_MIN_COSINE = 0.999
+
+
+def default_onnx_path(cache_dir, model_name):
+    """Path of the cached .onnx file for a model"""
+    return os.path.join(cache_dir, model_name.replace("/", "--") + "-audio.onnx")
+
+
+def export_audio_encoder(audio_encoder, onnx_path):
+    """Export a clap_torch.ClapAudioEncoder to ONNX with a fixed mel shape and dynamic batch"""
+    import torch
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    dummy_input = torch.zeros(INPUT_SHAPE, dtype=torch.float32)
+    start = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            audio_encoder.eval(),
+            (dummy_input,),
+            onnx_path,
+            input_names=["input_features"],
+            output_names=["audio_embeds"],
+            dynamic_axes={"input_features": {0: "batch"}, "audio_embeds": {0: "batch"}},
+            opset_version=OPSET_VERSION,
+        )
+    print(
+        f"Audio encoder exported to {onnx_path} in {time.perf_counter() - start:.1f} s"
+    )
+
+
+class OnnxAudioEncoder:
+    """Runs the exported audio encoder with ONNX Runtime on numpy input features."""
+
+    def __init__(self, onnx_path, num_threads=None):
+        if ort is None:
+            raise ImportError(
+                "onnxruntime not found, install it with: pip install onnxruntime"
+            )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_features, is_longer=None):
+        # is_longer is only used by fusion models, larger_clap_general is not one
+        input_features = np.ascontiguousarray(input_features, dtype=np.float32)
+        return self.session.run(None, {self.input_name: input_features})[0]
+
+
+def check_parity(reference_encoder, onnx_encoder, input_features_list):
+    """Compare ONNX and PyTorch embeddings, raises if they drift apart"""
+    worst_cosine = 1.0
+    worst_abs = 0.0
+    for input_features in input_features_list:
+        reference = reference_encoder(input_features)
+        candidate = onnx_encoder(input_features)
+        cosine = float(np.sum(reference * candidate, axis=-1).min())
+        worst_cosine = min(worst_cosine, cosine)
+        worst_abs = max(worst_abs, float(np.abs(reference - candidate).max()))
+    print(
+        f"ONNX parity: min cosine {worst_cosine:.6f}, max abs diff {worst_abs:.2e} "
+        f"over {len(input_features_list)} windows"
+    )
+    if worst_cosine < PARITY_MIN_COSINE:
+        raise RuntimeError(
+            f"ONNX embeddings differ from PyTorch (cosine {worst_cosine:.6f} "
+            f"< {PARITY_MIN_COSINE})"
+        )
+    return worst_cosine, worst_abs
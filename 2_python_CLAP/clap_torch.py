@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+"""
+PyTorch parts of the CLAP classifier: loading the model, encoding the labels with
+the text tower and running the audio encoder on numpy input features.
+
+The audio encoder can run in reduced precision: "int8" applies dynamic int8
+quantization to the Linear layers of the Swin stages, "bf16" casts the encoder to
+bfloat16 on CPUs with native bf16 instructions. See benchmark_precision.py for the
+accuracy report that gates these modes.
+
+Every window has the same mel shape, so the encoder can also be compiled once:
+"torchscript" traces and freezes it and saves the result in the cache folder,
+"inductor" uses torch.compile with its FX graph cache in the cache folder. Later
+starts load the cached artifact instead of compiling again. The inductor graphs
+are static, one per batch size; all batch sizes up to the configured one are
+compiled at startup, so no window waits for a recompile.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from transformers import ClapAudioModelWithProjection, ClapModel, ClapProcessor
+
+from clap_classifier import HYPOTHESIS_TEMPLATE, INPUT_SHAPE, normalize
+
+PRECISIONS = ("fp32", "int8", "bf16")
+ENGINES = ("eager", "torchscript", "inductor")
+
+
+class ClapAudioEncoder(torch.nn.Module):
+    """The CLAP audio tower plus audio projection, outputs normalized audio embeddings."""
+
+    def __init__(self, audio_model, audio_projection):
+        super().__init__()
+        self.audio_model = audio_model
+        self.audio_projection = audio_projection
+
+    def forward(self, input_features, is_longer=None):
+        audio_outputs = self.audio_model(
+            input_features=input_features, is_longer=is_longer
+        )
+        audio_embeds = self.audio_projection(audio_outputs.pooler_output)
+        return F.normalize(audio_embeds, dim=-1)
+
+
+class TorchAudioEncoder:
+    """Runs a ClapAudioEncoder on numpy input features, returns numpy embeddings."""
+
+    def __init__(self, module, dtype=None, eager_latency=None):
+        self.module = module.eval()
+        # bfloat16 in bf16 mode; frozen TorchScript modules have no parameters to ask
+        self.dtype = dtype or next(module.parameters()).dtype
+        self.eager_latency = eager_latency  # (first, steady state) s, compiled engines
+
+    def __call__(self, input_features, is_longer=None):
+        input_features = torch.from_numpy(input_features).to(self.dtype)
+        with torch.inference_mode():
+            if isinstance(self.module, torch.jit.ScriptModule):
+                # Traced for one window and only the mel input (is_longer is for
+                # fusion models), so a batch runs window by window
+                audio_embeds = torch.cat([self.module(x[None]) for x in input_features])
+            elif is_longer is None:
+                audio_embeds = self.module(input_features)
+            else:
+                audio_embeds = self.module(input_features, torch.from_numpy(is_longer))
+        return audio_embeds.float().numpy()
+
+
+def load_clap_model(model_name):
+    """Load the full CLAP model (audio and text tower) and its processor"""
+    model = ClapModel.from_pretrained(model_name).eval()
+    processor = ClapProcessor.from_pretrained(model_name)
+    return model, processor
+
+
+def load_audio_encoder(model_name):
+    """Load only the audio tower and projection from a CLAP checkpoint"""
+    audio_model = ClapAudioModelWithProjection.from_pretrained(model_name)
+    return ClapAudioEncoder(audio_model.audio_model, audio_model.audio_projection)
+
+
+def audio_encoder_from_model(model):
+    """Wrap the audio tower and projection of a loaded ClapModel"""
+    return ClapAudioEncoder(model.audio_model, model.audio_projection)
+
+
+def encode_labels(model, tokenizer, labels):
+    """Encode the labels with the CLAP text tower, returns a normalized (labels, dim) matrix"""
+    sequences = [HYPOTHESIS_TEMPLATE.format(label) for label in labels]
+    text_inputs = tokenizer(sequences, return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        text_embeds = model.get_text_features(**text_inputs)
+    return normalize(text_embeds.numpy().astype(np.float32))
+
+
+def audio_logit_scale(model):
+    """The scale the zero-shot pipeline applies to logits_per_audio"""
+    return float(model.logit_scale_a.exp())
+
+
+def set_threads(num_threads=None, interop_threads=None):
+    """Set the intra-op and inter-op thread counts of torch, None keeps the default"""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Only possible before the first inter-op parallel work
+            print(f"Cannot set the interop threads: {e}")
+
+
+def bf16_supported():
+    """Whether the CPU has native bfloat16 instructions (x86 AVX512/AMX or Arm BF16)"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return bool(flags & {"avx512_bf16", "amx_bf16", "bf16"})
+
+
+def apply_precision(audio_encoder, precision):
+    """Convert a ClapAudioEncoder in place to fp32, int8 or bf16"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, choose from {PRECISIONS}")
+    if precision == "int8":
+        if platform.machine() in ("aarch64", "armv7l"):
+            torch.backends.quantized.engine = "qnnpack"
+        # Only the Swin stages, the patch embedding and projection stay fp32
+        torch.ao.quantization.quantize_dynamic(
+            audio_encoder.audio_model.audio_encoder.layers,
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+            inplace=True,
+        )
+    elif precision == "bf16":
+        if not bf16_supported():
+            raise RuntimeError("This CPU has no native bfloat16 support")
+        audio_encoder.to(torch.bfloat16)
+    return audio_encoder
+
+
+def time_encoder(module, input_features, runs=3):
+    """First-call and median steady-state latency of a module in seconds"""
+    latencies = []
+    with torch.inference_mode():
+        for _ in range(runs + 1):
+            start = time.perf_counter()
+            module(input_features)
+            latencies.append(time.perf_counter() - start)
+    return latencies[0], float(np.median(latencies[1:]))
+
+
+def default_engine_path(cache_dir, model_name, precision, engine):
+    """Path of the cached compiled encoder, tied to the torch version that made it"""
+    name = model_name.replace("/", "--")
+    return os.path.join(
+        cache_dir, f"{name}-audio-{precision}-{engine}-torch{torch.__version__}.pt"
+    )
+
+
+@contextlib.contextmanager
+def inductor_cache_dir(path):
+    """Point the inductor caches at path while compiling, later compiles are unaffected"""
+    previous = os.environ.get("TORCHINDUCTOR_CACHE_DIR")
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = path
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("TORCHINDUCTOR_CACHE_DIR", None)
+        else:
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = previous
+
+
+def warm_up_batch_sizes(module, dtype, max_batch_size):
+    """Call module once per batch size, with the inputs of TorchAudioEncoder"""
+    with torch.inference_mode():
+        for batch_size in range(1, max_batch_size + 1):
+            module(
+                torch.zeros((batch_size, *INPUT_SHAPE[1:]), dtype=dtype),
+                torch.zeros((batch_size, 1), dtype=torch.bool),
+            )
+
+
+def compile_audio_encoder(audio_encoder, engine, artifact_path, max_batch_size=1):
+    """Compile a ClapAudioEncoder for the fixed mel shape, returns a TorchAudioEncoder
+
+    max_batch_size is the largest batch the encoder will get; inductor compiles
+    every batch size up to it here. The eager latency is measured when the artifact is built and stored next to it,
+    so later starts can still compare the compiled encoder with eager mode.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose from {ENGINES}")
+    if engine == "eager":
+        return TorchAudioEncoder(audio_encoder)
+
+    dtype = next(audio_encoder.parameters()).dtype
+    example_input = torch.zeros(INPUT_SHAPE, dtype=dtype)
+    timing_path = artifact_path + ".json"
+    eager_latency = None
+    if os.path.exists(timing_path):
+        with open(timing_path) as f:
+            eager_latency = tuple(json.load(f)["eager_latency"])
+
+    if engine == "inductor":
+        # torch.compile itself is lazy, the FX graph cache makes later starts fast
+        import torch._dynamo.config
+        import torch._inductor.config
+
+        torch._inductor.config.fx_graph_cache = True
+        # One static graph per batch size, partial batches included
+        torch._dynamo.config.cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit, max_batch_size
+        )
+        compiled = torch.compile(audio_encoder.eval(), dynamic=False)
+        start = time.perf_counter()
+        with inductor_cache_dir(os.path.splitext(artifact_path)[0]):
+            warm_up_batch_sizes(compiled, dtype, max_batch_size)
+        print(
+            f"Audio encoder compiled for batch sizes 1-{max_batch_size} in "
+            f"{time.perf_counter() - start:.1f} s"
+        )
+    elif os.path.exists(artifact_path):
+        print(f"Loading compiled audio encoder from {artifact_path}")
+        compiled = torch.jit.load(artifact_path)
+    else:
+        start = time.perf_counter()
+        with torch.no_grad():
+            traced = torch.jit.trace(audio_encoder.eval(), example_input)
+            compiled = torch.jit.freeze(traced)
+        os.makedirs(os.path.dirname(artifact_path) or ".", exist_ok=True)
+        torch.jit.save(compiled, artifact_path)
+        print(
+            f"Audio encoder traced in {time.perf_counter() - start:.1f} s, "
+            f"saved to {artifact_path}"
+        )
+
+    if eager_latency is None:
+        eager_latency = time_encoder(audio_encoder, example_input)
+        os.makedirs(os.path.dirname(timing_path) or ".", exist_ok=True)
+        with open(timing_path, "w") as f:
+            json.dump({"eager_latency": eager_latency}, f)
+    return TorchAudioEncoder(compiled, dtype=dtype, eager_latency=eager_latency)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Segmentation of the classified windows into sound events.
+
+Consecutive windows often carry the same top label with jittering scores, and a
+passing boat is one event, not twelve window messages. The segmenter smooths the
+score of every label over the recent windows (exponential average) and uses
+hysteresis on the smoothed score:
+- an event opens when the score stays at least open_score for min_windows
+  consecutive windows; it starts at the first of them,
+- it closes when the score drops below close_score (lower than open_score, so
+  jitter around one threshold does not split the event), or when the windows
+  stop arriving for max_gap_s.
+Only the windows with the event's label on top extend an event. While the score
+of the previous label decays after a label change, its event stays open, but the
+windows of the new label do not move its end or change its scores.
+Only the state changes are returned: one "open" and one "close" message per
+event, the close message with the start, end, peak and mean score and dB.
+
+Memory is constant: one smoothed score per label and at most one event per label.
+event_id counts the events since the start; with event_start it identifies an
+event, also after a restart of the sensor.
+"""
+
+import numpy as np
+
+from window_aggregator import RunningStats
+
+OPEN, CLOSE = "open", "close"
+
+
+class Event:
+    """Running statistics of one event of one label."""
+
+    def __init__(self, label, start):
+        self.label = label
+        self.event_id = None  # set when the event is opened
+        self.start = start
+        self.end = start
+        self.windows = 0
+        self.score_sum = 0.0
+        self.score_peak = 0.0
+        self.db_spl = RunningStats()
+
+    def add(self, end, score, db_spl):
+        self.end = end
+        self.windows += 1
+        self.score_sum += score
+        self.score_peak = max(self.score_peak, score)
+        self.db_spl.add(db_spl)
+
+    def fields(self, state):
+        """payload_fields of the open or close message"""
+        fields = {
+            "event": self.label,
+            "state": state,
+            "event_id": self.event_id,
+            "event_start": self.start,
+            "windows": self.windows,
+            "score_peak": self.score_peak,
+        }
+        if self.db_spl.count:
+            fields["db_spl_peak"] = self.db_spl.maximum
+        if state == CLOSE:
+            fields["event_end"] = self.end
+            fields["score_mean"] = self.score_sum / self.windows
+            if self.db_spl.count:
+                fields["db_spl_mean"] = self.db_spl.total / self.db_spl.count
+        return fields
+
+
+class EventSegmenter:
+    """Hysteresis on exponentially smoothed label scores of consecutive windows."""
+
+    def __init__(
+        self,
+        labels,
+        window_s,
+        smoothing=0.5,
+        open_score=0.3,
+        close_score=0.15,
+        min_windows=2,
+        max_gap_s=None,
+    ):
+        if close_score > open_score:
+            raise ValueError("close_score must not be above open_score")
+        self.labels = list(labels)
+        self.label_index = {label: i for i, label in enumerate(self.labels)}
+        self.window_s = window_s
+        self.smoothing = smoothing  # weight of the newest window in the average
+        self.open_score = open_score
+        self.close_score = close_score
+        self.min_windows = min_windows
+        self.max_gap = 2 * window_s if max_gap_s is None else max_gap_s
+        self.smoothed = None
+        self.last_start = None
+        self.events = {}  # label -> Event, pending until it has min_windows windows
+        self.next_id = 0
+        self.opened = 0
+
+    def add(self, unix_time, result, db_spl=None):
+        """Add the next window (its start time and ranked result), returns [payload_fields] of the state changes"""
+        changes = []
+        scores = np.zeros(len(self.labels))
+        for item in result:
+            if item["label"] in self.label_index:
+                scores[self.label_index[item["label"]]] = item["score"]
+        if self.last_start is not None and unix_time - self.last_start > self.max_gap:
+            changes += self.close_all()  # windows went missing, start afresh
+        if self.smoothed is None:
+            self.smoothed = scores
+        else:
+            self.smoothed += self.smoothing * (scores - self.smoothed)
+        self.last_start = unix_time
+        end = unix_time + self.window_s
+        top_label = result[0]["label"] if result else None
+        for i, label in enumerate(self.labels):
+            smoothed = self.smoothed[i]
+            event = self.events.get(label)
+            if event is None:
+                if smoothed < self.open_score or label != top_label:
+                    continue
+                event = self.events[label] = Event(label, unix_time)
+            elif event.event_id is None and smoothed < self.open_score:
+                del self.events[label]  # too short to open
+                continue
+            elif event.event_id is not None and smoothed < self.close_score:
+                changes.append(self.close(label))
+                continue
+            if label != top_label:
+                continue  # another label on top: keep the event, but do not extend it
+            event.add(end, float(scores[i]), db_spl)
+            if event.event_id is None and event.windows >= self.min_windows:
+                event.event_id = self.next_id
+                self.next_id += 1
+                self.opened += 1
+                changes.append(event.fields(OPEN))
+        return changes
+
+    def close(self, label):
+        return self.events.pop(label).fields(CLOSE)
+
+    def close_all(self):
+        """Close all open events (gap or shutdown), returns [payload_fields]; pending events are dropped"""
+        changes = [self.close(label) for label, event in list(self.events.items()) if event.event_id is not None]
+        self.events.clear()
+        self.smoothed = None
+        return changes
+
+    def stats(self):
+        return {"opened": self.opened, "open": sum(e.event_id is not None for e in self.events.values())}
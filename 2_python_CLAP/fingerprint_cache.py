@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Reuse the last classification for near-identical windows.
+
+Steady sources (airco hum, constant traffic) produce long runs of windows that
+CLAP classifies the same way every time. Each window gets a compact fingerprint:
+the log energy in a few frequency bands for a few time segments, computed from the
+power spectrogram of the DSP stage. When it matches one of the last windows
+(same spectral shape, similar level), the cached scores and embedding are used
+instead of running the model. After max_reuses reuses an entry is refreshed by the
+model, and the score drift between the cached and the fresh result is recorded,
+to tune the threshold.
+"""
+
+import collections
+
+import numpy as np
+
+FINGERPRINT_FLOOR = 1e-10  # power floor before the log
+
+
+def band_edges(n_freqs, n_bands, sample_rate, f_min=50.0):
+    """Indices of n_bands log-spaced frequency bands of a spectrum with n_freqs bins"""
+    bin_hz = sample_rate / (2 * (n_freqs - 1))
+    edges_hz = np.geomspace(f_min, sample_rate / 2, n_bands + 1)
+    edges = np.unique(np.clip(np.round(edges_hz / bin_hz).astype(int), 1, n_freqs - 1))
+    return edges[:-1]  # reduceat start indices, the last band runs to the top bin
+
+
+def band_fingerprint(power, n_bands=16, n_segments=5, sample_rate=48000):
+    """(segments x bands) log energy in dB of a (frames, frequency bins) power spectrogram, flattened"""
+    starts = band_edges(power.shape[1], n_bands, sample_rate)
+    bands = np.add.reduceat(power[:, starts[0] :], starts - starts[0], axis=1)
+    segments = np.array_split(bands, n_segments, axis=0)
+    energy = np.stack([segment.mean(axis=0) for segment in segments])
+    return (10.0 * np.log10(np.maximum(energy, FINGERPRINT_FLOOR))).ravel().astype(np.float32)
+
+
+def score_drift(old_result, new_result):
+    """Largest absolute score change of any label between two ranked results"""
+    old_scores = {item["label"]: item["score"] for item in old_result}
+    return max(abs(item["score"] - old_scores.get(item["label"], 0.0)) for item in new_result)
+
+
+class CacheEntry:
+    """Fingerprint, result and embedding of one classified window."""
+
+    def __init__(self, fingerprint, result, embedding=None):
+        self.fingerprint = fingerprint
+        self.shape = fingerprint - fingerprint.mean()
+        self.shape_norm = float(np.linalg.norm(self.shape))
+        self.level = float(fingerprint.mean())
+        self.result = result
+        self.embedding = embedding
+        self.reuses = 0
+
+
+class FingerprintCache:
+    """The last few classified windows, looked up by fingerprint similarity."""
+
+    def __init__(self, size=4, threshold=0.99, max_level_change=3.0, max_reuses=6):
+        self.entries = collections.deque(maxlen=size)
+        self.threshold = threshold  # cosine similarity of the spectral shapes
+        self.max_level_change = max_level_change  # dB difference of the mean level
+        self.max_reuses = max_reuses  # then the model runs again
+        self.counts = {"windows": 0, "reused": 0, "refreshed": 0, "missed": 0}
+        self.drift_total = 0.0
+        self.drift_max = 0.0
+
+    def similarity(self, entry, fingerprint):
+        """Cosine similarity of the spectral shapes, 0 when the levels differ too much"""
+        level = float(fingerprint.mean())
+        if abs(level - entry.level) > self.max_level_change:
+            return 0.0
+        shape = fingerprint - level
+        norm = float(np.linalg.norm(shape)) * entry.shape_norm
+        return float(np.dot(shape, entry.shape)) / norm if norm > 0 else 0.0
+
+    def lookup(self, fingerprint):
+        """(entry, reuse) for a new window
+
+        reuse True: use entry.result and entry.embedding instead of the model.
+        reuse False with an entry: a refresh is due, pass the entry to store().
+        (None, False): no similar window is cached.
+        """
+        self.counts["windows"] += 1
+        best, best_similarity = None, self.threshold
+        for entry in self.entries:
+            similarity = self.similarity(entry, fingerprint)
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        if best is None:
+            self.counts["missed"] += 1
+            return None, False
+        if best.reuses >= self.max_reuses:
+            self.counts["refreshed"] += 1
+            return best, False
+        best.reuses += 1
+        self.counts["reused"] += 1
+        return best, True
+
+    def store(self, fingerprint, result, embedding=None, replaces=None):
+        """Add a classified window; replaces is the entry of a refresh, to measure the drift"""
+        if replaces is not None:
+            drift = score_drift(replaces.result, result)
+            self.drift_total += drift
+            self.drift_max = max(self.drift_max, drift)
+            if replaces in self.entries:
+                self.entries.remove(replaces)
+        self.entries.append(CacheEntry(fingerprint, result, embedding))
+
+    def reuse_ratio(self):
+        """Fraction of the looked up windows that reused a cached result"""
+        windows = self.counts["windows"]
+        return self.counts["reused"] / windows if windows else 0.0
+
+    def stats(self):
+        refreshed = self.counts["refreshed"]
+        return {
+            **self.counts,
+            "reuse_ratio": self.reuse_ratio(),
+            "mean_drift": self.drift_total / refreshed if refreshed else 0.0,
+            "max_drift": self.drift_max,
+        }
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Fit the PCA basis of the embedding uplink and measure what it costs and keeps.
+
+The CLAP audio embeddings of our recordings (the teacher cache of train_student.py)
+are reduced to 32 ... 256 PCA components, quantized to int8 as in the EMBEDDING
+section of payload_codec.py and decoded again. For each size the script reports
+the cosine to the original embedding, the top-1 label agreement after re-scoring,
+the bytes per message and the uplink per day. The basis with N_COMPONENTS is
+saved to EMBEDDING_PCA_PATH; the server needs the same file to decode.
+"""
+
+import os
+
+import numpy as np
+
+import sound_scapes
+from clap_classifier import (
+    EMBEDDING_PCA_PATH,
+    MODEL_NAME,
+    encode_label_file,
+    load_label_embeddings,
+    softmax,
+)
+from payload_codec import EmbeddingPCA, decode_message, encode_message, uplink_bytes_per_day
+from train_student import LABEL_EMBEDDINGS_FILE, build_teacher_cache
+
+N_COMPONENTS = 128  # components of the saved basis
+CANDIDATES = (32, 64, 128, 256)
+VALIDATION_SPLIT = 0.2
+TOPIC = "pipeline/urbansounds/OE-007"
+SEED = 0
+
+
+def uplink_report(embeddings, label_embeds, logit_scale, pca=None):
+    """Quality and size of the embedding section for the given embeddings"""
+    labels = sound_scapes.marineterrein_labels
+    restored, sizes = [], []
+    for embedding in embeddings:
+        message = encode_message({}, 0, labels=labels, embedding=embedding, pca=pca)
+        sizes.append(len(message))
+        restored.append(decode_message(message, labels=labels, pca=pca)["payload_fields"]["embedding"])
+    restored = np.stack(restored)
+    expected = np.argmax(softmax(logit_scale * embeddings @ label_embeds.T), axis=1)
+    rescored = np.argmax(softmax(logit_scale * restored @ label_embeds.T), axis=1)
+    size = float(np.mean(sizes))
+    return {
+        "mean_cosine": float(np.mean(np.sum(restored * embeddings, axis=1))),
+        "top1_agreement": float(np.mean(expected == rescored)),
+        "section_bytes": size,
+        "mb_per_day": uplink_bytes_per_day(size, TOPIC) / 1e6,
+    }
+
+
+def main():
+    labels = sound_scapes.marineterrein_labels
+    _, embeddings = build_teacher_cache()
+    saved = load_label_embeddings(LABEL_EMBEDDINGS_FILE, MODEL_NAME, labels)
+    if saved is None:
+        saved = encode_label_file(MODEL_NAME, labels, LABEL_EMBEDDINGS_FILE)
+    label_embeds, logit_scale = saved
+
+    order = np.random.default_rng(SEED).permutation(len(embeddings))
+    n_validation = int(len(order) * VALIDATION_SPLIT)
+    validation, training = embeddings[order[:n_validation]], embeddings[order[n_validation:]]
+    print(f"Fitting on {len(training)} embeddings, validating on {len(validation)}")
+
+    for n_components in (None,) + CANDIDATES:
+        pca = None if n_components is None else EmbeddingPCA.fit(training, n_components)
+        report = uplink_report(validation, label_embeds, logit_scale, pca)
+        name = "full int8" if pca is None else f"PCA {n_components}"
+        print(
+            f"{name}: cosine {report['mean_cosine']:.4f}, top-1 agreement "
+            f"{report['top1_agreement']:.3f}, {report['section_bytes']:.0f} bytes per "
+            f"message without other fields, {report['mb_per_day']:.1f} MB per day"
+        )
+
+    os.makedirs(os.path.dirname(EMBEDDING_PCA_PATH), exist_ok=True)
+    EmbeddingPCA.fit(embeddings, N_COMPONENTS).save(EMBEDDING_PCA_PATH)
+    print(f"PCA basis with {N_COMPONENTS} components saved to {EMBEDDING_PCA_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""
+Run the CLAP classifier in a separate worker process.
+
+Recording, DSP and MQTT stay in the main process and the model runs in a worker
+process, so GIL contention and garbage collection in the model code cannot delay
+the audio capture. Audio windows are handed over through one
+multiprocessing.shared_memory buffer with a slot per window instead of pickled
+arrays; only the slot lengths and the classification results go over queues.
+
+The worker can be restarted at any time (for example after a crash or a model
+change) without touching the capture thread. The worker is started with "spawn",
+so the main script must keep its start-up code under if __name__ == "__main__".
+"""
+
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from clap_classifier import ClapLabelClassifier
+
+READY = "ready"
+
+
+def attach_shared_memory(name):
+    """Attach to an existing shared memory block without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def worker_main(shm_name, slots, window_samples, requests, results, classifier_kwargs):
+    """Entry point of the worker process: load the classifier and serve requests"""
+    shm = attach_shared_memory(shm_name)
+    buffers = np.ndarray((slots, window_samples), dtype=np.float32, buffer=shm.buf)
+    try:
+        classifier = ClapLabelClassifier.from_pretrained(**classifier_kwargs)
+        classifier.warm_up()
+        results.put((READY, None, None))
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            request_id, lengths = request
+            try:
+                windows = [buffers[i, :length] for i, length in enumerate(lengths)]
+                results.put((request_id, classifier.classify_batch(windows), None))
+            except Exception as e:
+                results.put((request_id, None, f"{type(e).__name__}: {e}"))
+    except Exception as e:
+        results.put((READY, None, f"{type(e).__name__}: {e}"))
+    finally:
+        del buffers
+        shm.close()
+
+
+class InferenceWorker:
+    """Classifier proxy with the same interface as ClapLabelClassifier."""
+
+    def __init__(
+        self,
+        classifier_kwargs,
+        slots=4,
+        window_samples=480000,
+        timeout=120,
+        start_timeout=900,
+    ):
+        self.classifier_kwargs = classifier_kwargs
+        self.labels = list(classifier_kwargs.get("labels", ()))
+        self.slots = slots
+        self.window_samples = window_samples
+        self.timeout = timeout  # seconds for one batch before the worker is restarted
+        self.start_timeout = start_timeout  # loading (and exporting) the model is slow
+        self.context = mp.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=slots * window_samples * np.float32().itemsize
+        )
+        self.buffers = np.ndarray(
+            (slots, window_samples), dtype=np.float32, buffer=self.shm.buf
+        )
+        self.process = None
+        self.request_id = 0
+        self.restarts = 0
+        self.start()
+
+    def start(self):
+        """Start a new worker process with fresh queues"""
+        self.requests = self.context.Queue()
+        self.results = self.context.Queue()
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(
+                self.shm.name,
+                self.slots,
+                self.window_samples,
+                self.requests,
+                self.results,
+                self.classifier_kwargs,
+            ),
+            name="clap-inference-worker",
+            daemon=True,
+        )
+        self.process.start()
+        self.ready = False
+        print(f"Inference worker started (pid {self.process.pid})")
+
+    def wait_ready(self):
+        """Block until the worker has loaded and warmed up the model"""
+        deadline = time.monotonic() + self.start_timeout
+        while not self.ready:
+            try:
+                status, _, error = self.results.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive() or time.monotonic() > deadline:
+                    raise RuntimeError("Inference worker did not start")
+                continue
+            if status == READY:
+                if error:
+                    raise RuntimeError(f"Inference worker failed to start: {error}")
+                self.ready = True
+
+    def stop(self, timeout=5):
+        """Stop the worker process, kill it if it does not exit in time"""
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+    def restart(self):
+        """Replace the worker process, the capture in this process keeps running"""
+        print("Restarting inference worker")
+        self.stop(timeout=1)
+        self.restarts += 1
+        self.start()
+
+    def close(self):
+        """Stop the worker and release the shared memory"""
+        self.stop()
+        del self.buffers
+        self.shm.close()
+        self.shm.unlink()
+
+    def warm_up(self):
+        """The worker warms up itself after loading, wait for it"""
+        self.wait_ready()
+
+    def classify_chunk(self, audio_windows):
+        """Copy up to `slots` windows into shared memory and wait for their results"""
+        self.wait_ready()
+        lengths = []
+        for i, audio_data in enumerate(audio_windows):
+            audio_data = audio_data[: self.window_samples]
+            self.buffers[i, : len(audio_data)] = audio_data
+            lengths.append(len(audio_data))
+        self.request_id += 1
+        self.requests.put((self.request_id, lengths))
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                request_id, results, error = self.results.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive() or time.monotonic() > deadline:
+                    self.restart()
+                    raise RuntimeError("Inference worker died or timed out, restarted")
+                continue
+            if request_id != self.request_id:
+                continue  # answer to a request from before a restart
+            if error:
+                raise RuntimeError(f"Inference worker error: {error}")
+            return results
+
+    def classify_batch(self, audio_windows, candidate_labels=None):
+        """Classify several windows in the worker, returns one result per window"""
+        if candidate_labels is not None and list(candidate_labels) != self.labels:
+            raise ValueError("The inference worker was started with other labels")
+        results = []
+        for start in range(0, len(audio_windows), self.slots):
+            results.extend(
+                self.classify_chunk(audio_windows[start : start + self.slots])
+            )
+        return results
+
+    def __call__(self, audio_data, candidate_labels=None):
+        """Classify one audio window, same interface as ClapLabelClassifier"""
+        return self.classify_batch([audio_data], candidate_labels)[0]
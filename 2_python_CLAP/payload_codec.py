@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+"""
+Compact binary encoding of the MQTT messages, shared by the sensor and the consumer.
+
+A JSON message repeats the label strings, app_id, dev_id and all field names,
+several hundred bytes per 10 s window. This encoding uses label indices into the
+label list of sound_scapes.py, scores quantized to 16 bits and fixed field ids
+with scaled integers, about 70 bytes.
+
+Layout (little endian):
+    header   magic "US", version, kind (window / alert / summary / event), crc32
+             of the label list,
+             message time in ms
+    sections tag (1 byte), length (2 bytes), body; tag | 0x80 = zlib-compressed body
+Sections:
+    SCORES       per label: index (1 byte), score * 65535 (2 bytes), in ranked order
+    FIELDS       per field: id (1 byte), value in the struct format of FIELD_SCHEMA
+    EXTRA        JSON of the fields that have no id, so nothing is lost
+    SPECTROGRAM  coarse log-mel image, 0.5 dB steps in one byte, optional
+    EMBEDDING    CLAP audio embedding as int8 with a float16 scale, optionally
+                 reduced with a PCA basis (EmbeddingPCA), so the server can
+                 re-score the window against any label set later
+    LABEL_STATS  per label of an interval summary: index, top-1 count, mean and
+                 max score (as SCORES), payload_fields["labels"] when decoded
+decode_message() returns the same dict as the JSON message, so the consumer code
+stays the same.
+
+Versions: VERSION 1 is the schema of this file, the first released one. Decoders
+skip unknown sections, but a field has no length, so an unknown field id cannot
+be skipped. A later change of FIELD_SCHEMA (a new id or an enum value) or of a
+section layout therefore bumps VERSION; ids are never reused or changed. The
+encoder then has to stamp each message with the lowest version whose schema covers
+its fields, so consumers that are not updated yet can still read the messages they
+understand. A decoder accepts its own and older versions and rejects newer messages
+with an error that says to update payload_codec.py on the consumer.
+
+Run this file to compare the sizes of an example message and the uplink per day.
+"""
+
+import json
+import struct
+import zlib
+
+import numpy as np
+
+import sound_scapes
+
+MAGIC = b"US"
+VERSION = 1  # see "Versions" above before changing FIELD_SCHEMA
+WINDOW, ALERT, SUMMARY, EVENT = 0, 1, 2, 3  # message kinds
+KINDS = {WINDOW: "window", ALERT: "alert", SUMMARY: "summary", EVENT: "event"}
+HEADER = struct.Struct("<2sBBIQ")  # magic, version, kind, label list crc32, time in ms
+SECTION = struct.Struct("<BH")  # tag, body length
+COMPRESSED = 0x80
+SCORES, FIELDS, EXTRA, SPECTROGRAM, EMBEDDING, LABEL_STATS = 1, 2, 3, 4, 5, 6
+LABEL_STAT = struct.Struct("<BHHH")  # label index, top-1 count, mean and max score
+SCORE_SCALE = 65535
+SPECTROGRAM_HEADER = struct.Struct("<HHf")  # frames, bands, dB of value 0
+SPECTROGRAM_STEP_DB = 0.5
+EMBEDDING_HEADER = struct.Struct("<HIe")  # values, PCA basis id (0 = full embedding), scale
+# Bytes per message on the link besides the payload: MQTT fixed header, topic length
+# and packet id, the 4-byte PUBACK, and 40 bytes of TCP/IP headers for each of the two
+MQTT_OVERHEAD = 2 + 2 + 2 + 4 + 2 * 40
+DEFAULT_LABELS = sound_scapes.marineterrein_labels
+
+# Field id -> (name, struct format, scale); "label" fields hold a label index,
+# "enum" fields the index of their value in the scale tuple
+FIELD_SCHEMA = {
+    1: ("start_recording", "I", 1),
+    2: ("RPI_temp", "h", 100),
+    3: ("ptp", "e", None),
+    4: ("rms", "f", None),
+    5: ("db_spl", "h", 100),
+    6: ("wind_speed", "H", 100),
+    7: ("queue_depth", "H", 1),
+    8: ("queue_lag", "H", 10),
+    9: ("dropped_windows", "I", 1),
+    10: ("gated", "B", 1),
+    11: ("alert", "label", None),
+    12: ("onset", "Q", 1000),
+    13: ("latency", "H", 100),
+    # Interval summaries (window_aggregator.py)
+    14: ("interval_start", "I", 1),
+    15: ("interval", "H", 1),
+    16: ("windows", "H", 1),
+    17: ("db_spl_min", "h", 100),
+    18: ("db_spl_mean", "h", 100),
+    19: ("db_spl_max", "h", 100),
+    20: ("ptp_min", "e", None),
+    21: ("ptp_mean", "e", None),
+    22: ("ptp_max", "e", None),
+    23: ("rms_min", "f", None),
+    24: ("rms_mean", "f", None),
+    25: ("rms_max", "f", None),
+    34: ("gated_windows", "I", 1),
+    # Events (event_segmenter.py)
+    26: ("event", "label", None),
+    27: ("state", "enum", ("open", "close")),
+    28: ("event_id", "I", 1),
+    29: ("event_start", "I", 1),
+    30: ("event_end", "I", 1),
+    31: ("score_peak", "H", SCORE_SCALE),
+    32: ("score_mean", "H", SCORE_SCALE),
+    33: ("db_spl_peak", "h", 100),
+    # Window reused the result of an earlier window (fingerprint_cache.py)
+    35: ("cached", "B", 1),
+}
+INTEGER_LIMITS = {  # value range of the scaled integer formats (Q: exact in float64)
+    "B": (0, 0xFF),
+    "H": (0, 0xFFFF),
+    "h": (-0x8000, 0x7FFF),
+    "I": (0, 0xFFFFFFFF),
+    "Q": (0, 2**53),
+}
+FIELD_IDS = {name: field_id for field_id, (name, _, _) in FIELD_SCHEMA.items()}
+
+
+def label_crc(labels):
+    """Identifies the label list; sensor and consumer must use the same one"""
+    return zlib.crc32("\n".join(labels).encode("utf-8"))
+
+
+def section(tag, body, compress=False):
+    """One encoded section, zlib-compressed when that makes it smaller"""
+    if compress:
+        packed = zlib.compress(body, 9)
+        if len(packed) < len(body):
+            tag, body = tag | COMPRESSED, packed
+    if len(body) > 0xFFFF:
+        raise ValueError(f"Section {tag & ~COMPRESSED} is {len(body)} bytes, at most 65535")
+    return SECTION.pack(tag, len(body)) + body
+
+
+def encode_field(field_id, value, label_index):
+    _, code, scale = FIELD_SCHEMA[field_id]
+    if code == "label":
+        return struct.pack("<BB", field_id, label_index[value])
+    if code == "enum":
+        return struct.pack("<BB", field_id, scale.index(value))
+    if scale is not None:
+        # Clipped to the integer range, e.g. -inf dB for a window of digital silence
+        low, high = INTEGER_LIMITS[code]
+        value = int(np.clip(np.nan_to_num(value * scale, nan=0.0, posinf=high, neginf=low), low, high))
+    return struct.pack(f"<B{code}", field_id, value)
+
+
+def spectrogram_image(log_mel, time_pool=10, floor_db=-100.0):
+    """Coarse uint8 image of a (frames, bands) log-mel: mean over time_pool frames, 0.5 dB steps"""
+    frames = len(log_mel) // time_pool * time_pool
+    pooled = log_mel[:frames].reshape(-1, time_pool, log_mel.shape[-1]).mean(axis=1)
+    steps = np.round((pooled - floor_db) / SPECTROGRAM_STEP_DB)
+    return np.clip(steps, 0, 255).astype(np.uint8), floor_db
+
+
+def quantize_embedding(vector):
+    """int8 values and float16 scale of a vector, vector ~ values * scale"""
+    vector = np.asarray(vector, dtype=np.float32)
+    scale = np.float16(max(float(np.max(np.abs(vector))), 1e-8) / 127.0)
+    values = np.clip(np.round(vector / np.float32(scale)), -127, 127).astype(np.int8)
+    return values, scale
+
+
+class EmbeddingPCA:
+    """PCA basis of CLAP audio embeddings, shared by the sensor and the server."""
+
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)  # (k, dim), orthonormal rows
+        self.basis_id = zlib.crc32(self.mean.tobytes() + self.components.tobytes()) or 1
+
+    @classmethod
+    def fit(cls, embeddings, n_components):
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        mean = embeddings.mean(axis=0)
+        _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+        return cls(mean, vt[:n_components])
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as saved:
+            return cls(saved["mean"], saved["components"])
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components)
+
+    def project(self, embedding):
+        return self.components @ (np.asarray(embedding, dtype=np.float32) - self.mean)
+
+    def reconstruct(self, coefficients):
+        """L2-normalized embedding from PCA coefficients"""
+        embedding = self.mean + np.asarray(coefficients, dtype=np.float32) @ self.components
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+
+def embedding_section(embedding, pca=None):
+    """EMBEDDING section body of a normalized audio embedding"""
+    vector = embedding if pca is None else pca.project(embedding)
+    values, scale = quantize_embedding(vector)
+    basis_id = 0 if pca is None else pca.basis_id
+    return EMBEDDING_HEADER.pack(len(values), basis_id, scale) + values.tobytes()
+
+
+def decode_embedding(body, pca=None):
+    """Normalized float32 embedding of an EMBEDDING section body"""
+    count, basis_id, scale = EMBEDDING_HEADER.unpack_from(body)
+    values = np.frombuffer(body, np.int8, count, EMBEDDING_HEADER.size)
+    vector = values.astype(np.float32) * np.float32(scale)
+    if basis_id == 0:
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+    if pca is None or pca.basis_id != basis_id:
+        raise ValueError(f"Embedding was reduced with PCA basis {basis_id}, load that basis")
+    return pca.reconstruct(vector)
+
+
+def quantize_score(score):
+    return int(round(min(max(score, 0.0), 1.0) * SCORE_SCALE))
+
+
+def encode_label_stats(label_stats, label_index):
+    """LABEL_STATS section body of {label: {"count", "mean", "max"}}"""
+    return b"".join(
+        LABEL_STAT.pack(
+            label_index[label],
+            min(stats["count"], 0xFFFF),
+            quantize_score(stats["mean"]),
+            quantize_score(stats["max"]),
+        )
+        for label, stats in label_stats.items()
+    )
+
+
+def encode_message(
+    payload_fields,
+    time_ms,
+    kind=WINDOW,
+    labels=DEFAULT_LABELS,
+    spectrogram=None,
+    embedding=None,
+    pca=None,
+):
+    """Binary message of a payload_fields dict as published in JSON
+
+    spectrogram is an optional (frames, bands) log-mel in dB, sent as a compressed
+    coarse image. embedding is an optional normalized CLAP audio embedding, sent as
+    int8, reduced with the EmbeddingPCA pca when given.
+    """
+    label_index = {label: i for i, label in enumerate(labels)}
+    scores, fields, extra = [], [], {}
+    for key, value in payload_fields.items():
+        if key in label_index:
+            scores.append(struct.pack("<BH", label_index[key], quantize_score(value)))
+        elif key in FIELD_IDS and value is not None:
+            fields.append(encode_field(FIELD_IDS[key], value, label_index))
+        else:
+            extra[key] = value
+    parts = [
+        HEADER.pack(MAGIC, VERSION, kind, label_crc(labels), int(time_ms)),
+        section(SCORES, b"".join(scores)),
+        section(FIELDS, b"".join(fields)),
+    ]
+    label_stats = extra.pop("labels", None) if isinstance(extra.get("labels"), dict) else None
+    if label_stats is not None:
+        parts.append(section(LABEL_STATS, encode_label_stats(label_stats, label_index)))
+    if extra:
+        parts.append(section(EXTRA, json.dumps(extra).encode("utf-8"), compress=True))
+    if spectrogram is not None:
+        image, floor_db = spectrogram_image(np.asarray(spectrogram))
+        body = SPECTROGRAM_HEADER.pack(*image.shape, floor_db) + image.tobytes()
+        parts.append(section(SPECTROGRAM, body, compress=True))
+    if embedding is not None:
+        parts.append(section(EMBEDDING, embedding_section(embedding, pca)))
+    return b"".join(parts)
+
+
+def decode_fields(body, labels):
+    fields = {}
+    offset = 0
+    while offset < len(body):
+        field_id = body[offset]
+        if field_id not in FIELD_SCHEMA:
+            # Sizes unknown, cannot skip; decode_message() rejects newer versions first
+            raise ValueError(f"Unknown field id {field_id} in a version {VERSION} message")
+        name, code, scale = FIELD_SCHEMA[field_id]
+        fmt = "<B" if code in ("label", "enum") else f"<{code}"
+        (value,) = struct.unpack_from(fmt, body, offset + 1)
+        offset += 1 + struct.calcsize(fmt)
+        if code == "label":
+            value = labels[value]
+        elif code == "enum":
+            value = scale[value]
+        elif scale is not None:
+            value = value / scale if scale != 1 else value
+        else:
+            value = float(value)
+        fields[name] = value
+    return fields
+
+
+def decode_sections(data):
+    """(tag, body) of every section after the header, bodies decompressed"""
+    offset = HEADER.size
+    while offset < len(data):
+        tag, length = SECTION.unpack_from(data, offset)
+        body = data[offset + SECTION.size : offset + SECTION.size + length]
+        offset += SECTION.size + length
+        if tag & COMPRESSED:
+            tag, body = tag & ~COMPRESSED, zlib.decompress(body)
+        yield tag, body
+
+
+def decode_message(data, labels=DEFAULT_LABELS, app_id=None, dev_id=None, pca=None):
+    """The JSON message dict of a binary message; app_id and dev_id come from the topic
+
+    The spectrogram, when present, is returned as a (frames, bands) float32 array
+    under payload_fields["spectrogram"], the embedding as a normalized float32
+    vector under payload_fields["embedding"] (pca: the EmbeddingPCA of the sensor).
+    """
+    magic, version, kind, crc, time_ms = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an urban sounds message")
+    if version > VERSION:
+        raise ValueError(
+            f"Message format version {version} is newer than this decoder (version "
+            f"{VERSION}), update payload_codec.py on the consumer"
+        )
+    if crc != label_crc(labels):
+        raise ValueError("Message was encoded with a different label list")
+    payload_fields = {}
+    for tag, body in decode_sections(data):
+        if tag == SCORES:
+            for index, quantized in struct.iter_unpack("<BH", body):
+                payload_fields[labels[index]] = quantized / SCORE_SCALE
+        elif tag == FIELDS:
+            payload_fields.update(decode_fields(body, labels))
+        elif tag == EXTRA:
+            payload_fields.update(json.loads(body))
+        elif tag == SPECTROGRAM:
+            frames, bands, floor_db = SPECTROGRAM_HEADER.unpack_from(body)
+            image = np.frombuffer(body, np.uint8, offset=SPECTROGRAM_HEADER.size)
+            payload_fields["spectrogram"] = (
+                image.reshape(frames, bands).astype(np.float32) * SPECTROGRAM_STEP_DB + floor_db
+            )
+        elif tag == EMBEDDING:
+            payload_fields["embedding"] = decode_embedding(body, pca)
+        elif tag == LABEL_STATS:
+            payload_fields["labels"] = {
+                labels[index]: {
+                    "count": count,
+                    "mean": mean / SCORE_SCALE,
+                    "max": maximum / SCORE_SCALE,
+                }
+                for index, count, mean, maximum in LABEL_STAT.iter_unpack(body)
+            }
+    return {
+        "app_id": app_id,
+        "dev_id": dev_id,
+        "kind": KINDS.get(kind, "unknown"),
+        "payload_fields": payload_fields,
+        "time": time_ms,
+    }
+
+
+def uplink_bytes_per_day(payload_bytes, topic, interval_s=10.0):
+    """Bytes per day on the link for one message of payload_bytes every interval_s seconds"""
+    return (payload_bytes + len(topic.encode("utf-8")) + MQTT_OVERHEAD) * 86400 / interval_s
+
+
+def main():
+    payload_fields = {
+        "Airco": 0.41234,
+        "Car": 0.21871,
+        "Noise": 0.12345,
+        "Talking": 0.05,
+        "Birds": 0.0312,
+        "start_recording": 1760000000,
+        "RPI_temp": 51.6,
+        "ptp": 0.2431,
+        "rms": 0.0123,
+        "db_spl": 55.7921,
+        "wind_speed": 4.12,
+        "queue_depth": 0,
+        "queue_lag": 0.0,
+        "dropped_windows": 0,
+        "gated": 0,
+    }
+    time_ms = 1760000010123
+    message = {"app_id": "urbansounds", "dev_id": "OE-007", "payload_fields": payload_fields, "time": time_ms}
+    binary = encode_message(payload_fields, time_ms)
+    decoded = decode_message(binary, app_id="urbansounds", dev_id="OE-007")
+    worst = max(abs(decoded["payload_fields"][key] - value) for key, value in payload_fields.items())
+    print(f"Largest decoding error of the fields: {worst:.5f}")
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((1000, 512)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    pca = EmbeddingPCA.fit(embeddings, 128)
+    log_mel = rng.normal(-40, 10, (1001, 64)).astype(np.float32)
+    sizes = {
+        "JSON": len(json.dumps(message).encode("utf-8")),
+        "binary": len(binary),
+        "binary + int8 embedding": len(encode_message(payload_fields, time_ms, embedding=embeddings[0])),
+        "binary + 128-d PCA embedding": len(
+            encode_message(payload_fields, time_ms, embedding=embeddings[0], pca=pca)
+        ),
+        "binary + spectrogram": len(encode_message(payload_fields, time_ms, spectrogram=log_mel)),
+    }
+    restored = decode_message(encode_message(payload_fields, time_ms, embedding=embeddings[0]))
+    print(f"int8 embedding cosine to the original: {float(restored['payload_fields']['embedding'] @ embeddings[0]):.5f}")
+    topic = "pipeline/urbansounds/OE-007"
+    for name, size in sizes.items():
+        per_day = uplink_bytes_per_day(size, topic) / 1e6
+        print(f"{name}: {size} bytes per message, {per_day:.1f} MB per day with MQTT and TCP/IP overhead")
+
+
+if __name__ == "__main__":
+    main()
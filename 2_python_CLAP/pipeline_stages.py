@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Small declared stage graph for the per-window work, run on thread pools.
+
+A stage is a function of one context dict: the inputs of the run plus the results
+of the stages it depends on, stored under their stage names. A stage is submitted
+to its executor as soon as its dependencies are done, so independent stages (DSP,
+CPU temperature, wind speed) overlap, and a stage never blocks a pool thread while
+waiting for another. Stages that must run one at a time and in order (the model,
+the MQTT publish) get a single-thread executor of their own and ordered=True: the
+stage of a run then also waits for the same stage of the previous run, so a fast
+run cannot overtake a run whose other stages (e.g. a slow wind lookup) are late.
+
+Every run records the wall time of each stage, so slow stages are visible.
+StageStats averages them per window to find the stage that limits the window rate.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Stage:
+    """One named step of the graph."""
+
+    def __init__(self, name, func, deps=(), executor=None, ordered=False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.executor = executor  # None = the default executor of the graph
+        self.ordered = ordered  # after the same stage of the previous run
+
+
+class GraphRun:
+    """Futures and stage timings of one run of a StageGraph."""
+
+    def __init__(self, stages, inputs):
+        self.context = dict(inputs)
+        self.futures = {stage.name: Future() for stage in stages}
+        self.timings = {}  # stage name -> wall time in seconds
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def elapsed(self):
+        """Wall time from the start of the run to the end of the last stage"""
+        return (self.finished or time.perf_counter()) - self.started
+
+
+class StageGraph:
+    """Runs declared stages with dependencies on thread pool executors."""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.stages = []
+        self.last_futures = {}  # ordered stage name -> its future in the latest run
+        self.run_lock = threading.Lock()
+
+    def add(self, name, func, deps=(), executor=None, ordered=False):
+        """Declare a stage; its dependencies must be declared before it
+
+        An ordered stage also waits for itself in the previous run (it still runs
+        when that one failed).
+        """
+        known = {stage.name for stage in self.stages}
+        missing = [dep for dep in deps if dep not in known]
+        if missing:
+            raise ValueError(f"Stage {name} depends on undeclared stages {missing}")
+        self.stages.append(Stage(name, func, deps, executor, ordered))
+        return self
+
+    def run(self, **inputs):
+        """Start all stages for one set of inputs, returns a GraphRun right away"""
+        run = GraphRun(self.stages, inputs)
+        previous = {}
+        with self.run_lock:
+            for stage in self.stages:
+                if stage.ordered:
+                    previous[stage.name] = self.last_futures.get(stage.name)
+                    self.last_futures[stage.name] = run.futures[stage.name]
+        remaining = {
+            stage.name: len(stage.deps) + (previous.get(stage.name) is not None)
+            for stage in self.stages
+        }
+        lock = threading.Lock()
+        last_stage = self.stages[-1].name
+
+        def finish(stage, result=None, error=None):
+            if stage.name == last_stage:
+                run.finished = time.perf_counter()
+            if error is None:
+                run.futures[stage.name].set_result(result)
+            else:
+                run.futures[stage.name].set_exception(error)
+
+        def execute(stage):
+            start = time.perf_counter()
+            try:
+                result = stage.func(run.context)
+            except Exception as e:
+                run.timings[stage.name] = time.perf_counter() - start
+                finish(stage, error=e)
+                return
+            run.timings[stage.name] = time.perf_counter() - start
+            run.context[stage.name] = result
+            finish(stage, result)
+
+        def launch(stage):
+            for dep in stage.deps:
+                error = run.futures[dep].exception()
+                if error is not None:
+                    finish(stage, error=error)  # skip, a dependency failed
+                    return
+            (stage.executor or self.executor).submit(execute, stage)
+
+        def dependency_done(stage):
+            with lock:
+                remaining[stage.name] -= 1
+                ready = remaining[stage.name] == 0
+            if ready:
+                launch(stage)
+
+        for stage in self.stages:
+            waits_for = [run.futures[dep] for dep in stage.deps]
+            if previous.get(stage.name) is not None:
+                waits_for.append(previous[stage.name])
+            if not waits_for:
+                launch(stage)
+            for future in waits_for:
+                future.add_done_callback(lambda _, stage=stage: dependency_done(stage))
+        return run
+
+
+class StageStats:
+    """Smoothed wall time per window of each stage, over many GraphRuns."""
+
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing  # weight of the newest run
+        self.per_window = {}  # stage name -> seconds per window
+
+    def add(self, run, n_windows):
+        """Include the timings of a finished run of n_windows windows"""
+        for name, seconds in run.timings.items():
+            value = seconds / max(n_windows, 1)
+            mean = self.per_window.get(name)
+            self.per_window[name] = (
+                value if mean is None else mean + self.smoothing * (value - mean)
+            )
+
+    def bottleneck(self, names):
+        """(name, seconds per window) of the slowest of the given stages, (None, 0.0) before any run"""
+        measured = [(self.per_window[name], name) for name in names if name in self.per_window]
+        if not measured:
+            return None, 0.0
+        seconds, name = max(measured)
+        return name, seconds
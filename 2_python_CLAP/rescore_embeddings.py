@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Server side: re-score the uplinked audio embeddings against any label set.
+
+Sensors with EMBEDDING_UPLINK send the (int8, optionally PCA-reduced) CLAP audio
+embedding of every classified window in the binary payload (payload_codec.py).
+This script subscribes to their topics, decodes the embeddings and scores them
+against LABELS, which can differ from the labels of the sensors, e.g. after adding
+a class. Only the text tower runs here, once per label set.
+
+rescore() also works offline on stored embeddings, e.g. to re-label history.
+"""
+
+import logging
+import os
+
+import numpy as np
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+
+import config
+import sound_scapes
+from clap_classifier import EMBEDDING_PCA_PATH, MODEL_NAME, encode_label_file, softmax
+from payload_codec import EMBEDDING, EmbeddingPCA, decode_message, decode_sections
+
+TOPIC = "pipeline/urbansounds/+"  # window topics of all sensors, not the /alert topics
+# The label set to score; the sensors' own list stays needed to decode their messages
+LABELS = sound_scapes.marineterrein_labels + ["Dog", "Bicycle bell", "Boat horn"]
+TOP_K = 3
+
+logger = logging.getLogger(__name__)
+
+
+def rescore(embeddings, label_embeds, logit_scale):
+    """Label probabilities of normalized audio embeddings, shape (windows, labels)"""
+    return softmax(logit_scale * np.atleast_2d(embeddings) @ label_embeds.T)
+
+
+class RescoringConsumer:
+    """MQTT consumer that prints the top labels of every uplinked embedding."""
+
+    def __init__(self, labels, pca=None):
+        self.labels = list(labels)
+        self.pca = pca
+        self.label_embeds, self.logit_scale = encode_label_file(MODEL_NAME, self.labels, None)
+        self.windows = 0
+        self.skipped = 0
+
+    def on_message(self, client, userdata, message):
+        payload = message.payload
+        if not payload.startswith(b"US"):
+            return  # JSON message of a sensor without the binary format
+        if not any(tag == EMBEDDING for tag, _ in decode_sections(payload)):
+            return
+        try:
+            fields = decode_message(payload, pca=self.pca)["payload_fields"]
+            scores = rescore(fields["embedding"], self.label_embeds, self.logit_scale)[0]
+        except ValueError as e:
+            # newer format version, truncated message or an embedding of another PCA/model
+            self.skipped += 1
+            logger.warning(f"Skipping message on {message.topic}: {e}")
+            return
+        top = np.argsort(scores)[::-1][:TOP_K]
+        self.windows += 1
+        ranked = ", ".join(f"{self.labels[i]} {scores[i]:.3f}" for i in top)
+        print(f"{message.topic} {fields.get('start_recording')}: {ranked}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    pca = EmbeddingPCA.load(EMBEDDING_PCA_PATH) if os.path.exists(EMBEDDING_PCA_PATH) else None
+    consumer = RescoringConsumer(LABELS, pca)
+    client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
+    client.username_pw_set(config.mqtt_user, config.mqtt_password)
+    client.on_message = consumer.on_message
+    client.on_connect = lambda client, userdata, flags, reason_code, properties: client.subscribe(TOPIC, qos=1)
+    client.connect(config.mqtt_host, keepalive=300)
+    try:
+        client.loop_forever()
+    except KeyboardInterrupt:
+        print(f"\nRe-scored {consumer.windows} windows, skipped {consumer.skipped} undecodable messages")
+
+
+if __name__ == "__main__":
+    main()
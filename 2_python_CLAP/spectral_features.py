@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Shared spectral feature stage: one pass over each window for all DSP results.
+
+Before, every window was framed and transformed several times: librosa.stft for
+the spectrogram, librosa.feature.rms for the RMS, np.ptp for the peak-to-peak value
+and the CLAP feature extractor for the log-mel input. This stage transforms each
+window once with the CLAP framing (1024-point FFT, hop 480) of mel_frontend.py and
+derives from that:
+- the magnitude spectrogram (frequency bins x frames),
+- the CLAP log-mel input, ready for ClapLabelClassifier.classify_features,
+and from a single running sum of squares of the samples:
+- the RMS per frame, identical to librosa.feature.rms (2048-sample frames, hop 512,
+  centered with zero padding), so db_spl keeps its calibration.
+
+StreamingFeatureStage does the same for overlapping windows that start every hop
+(sliding-window classification): the STFT frames inside the overlap are taken from
+the previous window instead of being transformed again. The rest of the work
+(copying the window into the padded buffer, ptp and RMS) still covers the whole
+window, overlap included.
+"""
+
+import numpy as np
+
+from mel_frontend import ClapMelFrontend
+
+RMS_FRAME_LENGTH = 2048  # librosa.feature.rms defaults
+RMS_HOP_LENGTH = 512
+
+
+def frame_rms(
+    audio_data, frame_length=RMS_FRAME_LENGTH, hop_length=RMS_HOP_LENGTH, scratch=None
+):
+    """RMS per frame like librosa.feature.rms(y=audio_data)[0], from a cumulative sum
+
+    scratch is an optional float64 buffer of at least len(audio_data) + frame_length
+    + 1 samples for the running sum.
+    """
+    half = frame_length // 2
+    size = len(audio_data) + 2 * half + 1
+    if scratch is None or len(scratch) < size:
+        scratch = np.empty(size)
+    cumulative = scratch[:size]
+    cumulative[: half + 1] = 0.0
+    cumulative[half + 1 + len(audio_data) :] = 0.0
+    squares = cumulative[half + 1 : half + 1 + len(audio_data)]
+    np.square(audio_data, out=squares, dtype=np.float64)
+    np.cumsum(cumulative, out=cumulative)
+    starts = np.arange(1 + len(audio_data) // hop_length) * hop_length
+    energy = cumulative[starts + frame_length] - cumulative[starts]
+    return np.sqrt(np.maximum(energy, 0.0) / frame_length)
+
+
+class WindowFeatures:
+    """DSP results of one window, shared by the classifier and the downstream stages."""
+
+    def __init__(self, samples, ptp, rms, power, input_features, is_longer):
+        # float32 samples in [-1, 1) (also for int16 capture), a view of the
+        # front-end buffer like power and input_features
+        self.samples = samples
+        self.ptp = ptp  # peak-to-peak value of the samples
+        self.rms = rms  # RMS per frame, as librosa.feature.rms
+        self.rms_mean = float(np.mean(rms))
+        self.power = power  # (frames, frequency bins) power spectrogram
+        # (1, 1001, 64) CLAP log-mel. The views are only valid until the feature
+        # stage processes the next batch
+        self.input_features = input_features
+        self.is_longer = is_longer
+
+    @property
+    def spectrogram(self):
+        """Magnitude spectrogram (frequency bins x frames), computed on first use"""
+        return np.sqrt(self.power.T)
+
+
+class SpectralFeatureStage:
+    """Computes WindowFeatures for a batch of windows with one batched FFT."""
+
+    def __init__(self, frontend=None, compute_mel=True):
+        self.frontend = frontend or ClapMelFrontend()
+        # Without the mel (classifier in another process) the FFT is still shared
+        # by the spectrogram
+        self.compute_mel = compute_mel
+        self.rms_scratch = np.empty(self.frontend.max_samples + RMS_FRAME_LENGTH + 1)
+
+    def __call__(self, audio_windows):
+        """Features of a list of windows, returns (features, input_features, is_longer)
+
+        input_features is the (windows, 1, 1001, 64) CLAP input of the whole batch,
+        or None when compute_mel is off.
+        """
+        waveforms, is_longer = self.frontend.prepare(list(audio_windows))
+        power = self.frontend.power_spectrogram(waveforms)
+        input_features = self.frontend.log_mel(power) if self.compute_mel else None
+        features = [
+            WindowFeatures(
+                samples=samples,
+                ptp=np.ptp(samples),
+                rms=frame_rms(samples, scratch=self.rms_scratch),
+                power=power[i],
+                input_features=None if input_features is None else input_features[i],
+                is_longer=is_longer[i],
+            )
+            for i, samples in enumerate(waveforms)
+        ]
+        return features, input_features, is_longer
+
+
+class StreamingState:
+    """Power and log-mel frames of the last window, carried over to the next one."""
+
+    def __init__(self, frontend, hop_samples):
+        if hop_samples % frontend.hop_length or not 0 < hop_samples <= frontend.max_samples:
+            raise ValueError(
+                f"Hop of {hop_samples} samples must be a multiple of the "
+                f"{frontend.hop_length}-sample STFT hop, up to one window"
+            )
+        self.frontend = frontend
+        self.hop_samples = hop_samples
+        self.hop_frames = hop_samples // frontend.hop_length
+        n_freqs = frontend.n_fft // 2 + 1
+        self.power = np.zeros((frontend.n_frames, n_freqs), dtype=np.float32)
+        self.mel = np.zeros((frontend.n_frames, frontend.n_mels), dtype=np.float32)
+        # Last max_samples - hop samples of the previous window, to detect continuity
+        self.tail = np.zeros(frontend.max_samples - hop_samples, dtype=np.float32)
+        self.valid = False
+        self.reused_frames = 0
+        self.computed_frames = 0
+
+    def update(self, samples, frames):
+        """Advance to the next window, given its samples and (1001, n_fft) frames
+
+        Frames 2 ... n - 3 do not touch the reflect padding, so when the window
+        continues the previous one by exactly one hop they equal frames hop_frames
+        later in the previous window. Only the new frames at the end and the four
+        edge frames are transformed. After a dropped window everything is.
+        """
+        n = self.frontend.n_frames
+        overlap = len(self.tail)
+        shift = self.hop_frames
+        continuous = (
+            self.valid and shift < n - 4 and np.array_equal(samples[:overlap], self.tail)
+        )
+        if continuous:
+            self.power[2 : n - 2 - shift] = self.power[2 + shift : n - 2]
+            self.mel[2 : n - 2 - shift] = self.mel[2 + shift : n - 2]
+            index = np.r_[0, 1, n - 2 - shift : n]
+        else:
+            index = np.arange(n)
+        power = self.frontend.frame_power(frames[index])
+        self.power[index] = power
+        self.mel[index] = self.frontend.mel_frames(power, np.empty_like(self.mel[index]))
+        self.tail[:] = samples[len(samples) - overlap :]
+        self.valid = True
+        self.computed_frames += len(index)
+        self.reused_frames += n - len(index)
+
+    def reuse_ratio(self):
+        """Fraction of the STFT frames taken from the previous window so far"""
+        total = self.reused_frames + self.computed_frames
+        return self.reused_frames / total if total else 0.0
+
+
+class StreamingFeatureStage(SpectralFeatureStage):
+    """SpectralFeatureStage for overlapping windows that start every hop_samples.
+
+    The windows must arrive in recording order through one StreamingState; several
+    stages (one per batch in flight) can share the state when they run one at a time.
+    """
+
+    def __init__(self, hop_samples, frontend=None, compute_mel=True, state=None):
+        super().__init__(frontend, compute_mel)
+        self.state = state or StreamingState(self.frontend, hop_samples)
+
+    def __call__(self, audio_windows):
+        """Features of a list of windows, returns (features, input_features, is_longer)"""
+        frontend = self.frontend
+        waveforms, is_longer = frontend.prepare(list(audio_windows))
+        frames = frontend.frames(waveforms)
+        power = frontend.scratch(
+            "power", (len(waveforms), frontend.n_frames, frontend.n_fft // 2 + 1)
+        )
+        input_features = frontend.output_buffer(len(waveforms)) if self.compute_mel else None
+        for i, samples in enumerate(waveforms):
+            self.state.update(samples, frames[i])
+            power[i] = self.state.power
+            if input_features is not None:
+                input_features[i, 0] = self.state.mel
+        features = [
+            WindowFeatures(
+                samples=samples,
+                ptp=np.ptp(samples),
+                rms=frame_rms(samples, scratch=self.rms_scratch),
+                power=power[i],
+                input_features=None if input_features is None else input_features[i],
+                is_longer=is_longer[i],
+            )
+            for i, samples in enumerate(waveforms)
+        ]
+        return features, input_features, is_longer
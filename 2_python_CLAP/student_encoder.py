@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Small student audio encoder, distilled from the CLAP (HTSAT) audio encoder.
+
+The student is a compact CNN on the same (1, 1001, 64) log-mel input as CLAP. It
+is trained with train_student.py to regress the teacher's normalized 512-d audio
+embeddings, so it works with the cached CLAP label embeddings of
+clap_classifier.py. Select it with CLASSIFIER_BACKEND = "student".
+"""
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+
+def conv_block(in_channels, out_channels):
+    """Depthwise-separable convolution that halves time and frequency"""
+    return nn.Sequential(
+        nn.Conv2d(
+            in_channels,
+            in_channels,
+            kernel_size=3,
+            stride=2,
+            padding=1,
+            groups=in_channels,
+            bias=False,
+        ),
+        nn.BatchNorm2d(in_channels),
+        nn.ReLU(inplace=True),
+        nn.Conv2d(in_channels, out_channels, kernel_size=1, bias=False),
+        nn.BatchNorm2d(out_channels),
+        nn.ReLU(inplace=True),
+    )
+
+
+class StudentAudioEncoder(nn.Module):
+    """Compact CNN that maps CLAP log-mel features into the CLAP audio embedding space."""
+
+    def __init__(self, mel_bins=64, channels=(32, 64, 128, 256), embed_dim=512):
+        super().__init__()
+        self.config = {
+            "mel_bins": mel_bins,
+            "channels": list(channels),
+            "embed_dim": embed_dim,
+        }
+        # Normalize per mel bin, like the bn0 layer of HTSAT
+        self.bn0 = nn.BatchNorm2d(mel_bins)
+        self.stem = nn.Sequential(
+            nn.Conv2d(1, channels[0], kernel_size=3, stride=2, padding=1, bias=False),
+            nn.BatchNorm2d(channels[0]),
+            nn.ReLU(inplace=True),
+        )
+        self.blocks = nn.Sequential(
+            *[conv_block(a, b) for a, b in zip(channels[:-1], channels[1:])]
+        )
+        self.projection = nn.Sequential(
+            nn.Linear(2 * channels[-1], embed_dim),
+            nn.ReLU(inplace=True),
+            nn.Linear(embed_dim, embed_dim),
+        )
+
+    def forward(self, input_features, is_longer=None):
+        # (batch, 1, frames, mel bins) -> normalize over the mel bins
+        x = self.bn0(input_features.transpose(1, 3)).transpose(1, 3)
+        x = self.blocks(self.stem(x))
+        x = x.mean(dim=3)  # pool over frequency
+        x = torch.cat([x.mean(dim=2), x.amax(dim=2)], dim=1)  # mean and max over time
+        return F.normalize(self.projection(x), dim=-1)
+
+
+def save_student(module, path):
+    """Save the student configuration and weights"""
+    torch.save({"config": module.config, "state_dict": module.state_dict()}, path)
+
+
+def load_student(path):
+    """Load a student saved with save_student, in eval mode"""
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    module = StudentAudioEncoder(**checkpoint["config"])
+    module.load_state_dict(checkpoint["state_dict"])
+    return module.eval()
@@ -0,0 +1,26 @@
+"""Tests of the segmentation of the windows into events."""
+
+from event_segmenter import CLOSE, OPEN, EventSegmenter
+
+LABELS = ["Boat", "Car"]
+
+
+def ranked(boat, car):
+    result = [{"score": boat, "label": "Boat"}, {"score": car, "label": "Car"}]
+    return sorted(result, key=lambda item: item["score"], reverse=True)
+
+
+def test_event_ends_at_the_last_window_of_its_label():
+    segmenter = EventSegmenter(LABELS, window_s=10)
+    changes = []
+    for i, (boat, car) in enumerate([(0.9, 0.1)] * 2 + [(0.1, 0.9)] * 6):
+        changes += segmenter.add(1760000000 + 10 * i, ranked(boat, car), db_spl=60.0)
+    states = [(change["event"], change["state"]) for change in changes]
+    assert states == [("Boat", OPEN), ("Car", OPEN), ("Boat", CLOSE)]
+
+    boat_close = changes[2]
+    assert boat_close["event_start"] == 1760000000
+    assert boat_close["event_end"] == 1760000020  # not extended by the Car windows
+    assert boat_close["windows"] == 2
+    assert boat_close["score_mean"] == 0.9
+    assert changes[1]["event_start"] == 1760000020
@@ -0,0 +1,33 @@
+"""Tests of the binary message versions."""
+
+import pytest
+
+from payload_codec import HEADER, VERSION, WINDOW, decode_message, encode_message
+
+FIELDS = {"Car": 0.5, "Noise": 0.25, "start_recording": 1760000000, "db_spl": 55.5}
+
+
+def with_version(message, version):
+    magic, _, kind, crc, time_ms = HEADER.unpack_from(message)
+    return HEADER.pack(magic, version, kind, crc, time_ms) + message[HEADER.size :]
+
+
+def test_window_message_round_trips():
+    message = encode_message(FIELDS, 1760000010000, WINDOW)
+    assert HEADER.unpack_from(message)[1] == VERSION
+    decoded = decode_message(message)["payload_fields"]
+    assert decoded["start_recording"] == 1760000000
+    assert decoded["db_spl"] == 55.5
+
+
+def test_newer_version_is_rejected_with_a_clear_error():
+    message = with_version(encode_message(FIELDS, 1760000010000, WINDOW), VERSION + 1)
+    with pytest.raises(ValueError, match="newer than this decoder"):
+        decode_message(message)
+
+
+def test_cached_flag_round_trips():
+    message = encode_message({**FIELDS, "gated": 0, "cached": 1}, 1760000010000, WINDOW)
+    decoded = decode_message(message)["payload_fields"]
+    assert decoded["cached"] == 1
+    assert decoded["gated"] == 0
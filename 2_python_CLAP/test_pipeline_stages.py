@@ -0,0 +1,67 @@
+"""Tests of the stage graph: ordered stages keep the order of the runs."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline_stages import StageGraph
+
+
+def run_graph(ordered, runs=4):
+    """Publish order of runs whose first run has a slow independent stage"""
+    executor = ThreadPoolExecutor(max_workers=4)
+    publish_executor = ThreadPoolExecutor(max_workers=1)
+    published = []
+    first_run_started = threading.Event()
+
+    def slow_for_first_run(context):
+        if context["index"] == 0:
+            first_run_started.set()
+            time.sleep(0.2)  # e.g. a slow wind lookup
+        return context["index"]
+
+    graph = StageGraph(executor)
+    graph.add("features", lambda context: context["index"])
+    graph.add("wind", slow_for_first_run)
+    graph.add(
+        "publish",
+        lambda context: published.append(context["index"]),
+        deps=("features", "wind"),
+        executor=publish_executor,
+        ordered=ordered,
+    )
+    graph_runs = []
+    for index in range(runs):
+        graph_runs.append(graph.run(index=index))
+        if index == 0:
+            first_run_started.wait()
+    for graph_run in graph_runs:
+        graph_run.futures["publish"].result(timeout=5)
+    executor.shutdown()
+    publish_executor.shutdown()
+    return published
+
+
+def test_ordered_stage_keeps_run_order():
+    assert run_graph(ordered=True) == [0, 1, 2, 3]
+
+
+def test_unordered_stage_can_be_overtaken():
+    assert run_graph(ordered=False)[-1] == 0
+
+
+def test_ordered_stage_runs_after_a_failed_previous_run():
+    executor = ThreadPoolExecutor(max_workers=2)
+    published = []
+
+    def publish(context):
+        if context["index"] == 0:
+            raise RuntimeError("broker down")
+        published.append(context["index"])
+
+    graph = StageGraph(executor).add("publish", publish, ordered=True)
+    first, second = graph.run(index=0), graph.run(index=1)
+    assert isinstance(first.futures["publish"].exception(timeout=5), RuntimeError)
+    second.futures["publish"].result(timeout=5)
+    executor.shutdown()
+    assert published == [1]
@@ -0,0 +1,30 @@
+"""Tests of the interval summaries and their binary encoding."""
+
+from payload_codec import SUMMARY, decode_message, encode_message
+from window_aggregator import WindowAggregator
+
+LABELS = ["Silence", "Car", "Noise"]
+
+
+def gated_result():
+    return [
+        {"score": 1.0, "label": "Silence"},
+        {"score": 0.0, "label": "Car"},
+        {"score": 0.0, "label": "Noise"},
+    ]
+
+
+def test_gated_window_count_above_255_round_trips():
+    aggregator = WindowAggregator(LABELS, interval_s=3600)
+    for i in range(360):
+        fields = {"db_spl": 30.0, "ptp": 0.01, "rms": 0.001, "gated": 1}
+        assert aggregator.add(1760000400 + 10 * i, gated_result(), fields) is None
+    summary, _ = aggregator.flush()
+    assert summary["gated_windows"] == 360
+    assert "gated" not in summary
+
+    message = encode_message(summary, 1760004000000, SUMMARY, labels=LABELS)
+    decoded = decode_message(message, labels=LABELS)["payload_fields"]
+    assert decoded["gated_windows"] == 360
+    assert decoded["windows"] == 360
+    assert decoded["labels"]["Silence"]["count"] == 360
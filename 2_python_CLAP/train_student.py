@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Train a small student audio encoder against the CLAP audio embeddings (on CPU).
+
+1. Cut our UrbanSounds recordings (Hugging Face datasets plus the local samples
+   folder) into 10 s windows and compute the CLAP log-mel features and the
+   teacher's normalized 512-d audio embeddings once. They are cached in the cache
+   folder.
+2. Train the StudentAudioEncoder of student_encoder.py to regress the teacher
+   embeddings (MSE plus cosine loss) with gain, time shift and masking augmentation.
+3. Compare student and teacher on the held-out windows: cosine similarity, top-1
+   agreement with the cached label embeddings, and latency per window.
+4. Save the student to STUDENT_PATH, where clap_classifier loads it for
+   CLASSIFIER_BACKEND = "student".
+"""
+
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+import torch.nn.functional as F
+from datasets import Audio, load_dataset
+
+import clap_torch
+import sound_scapes
+from clap_classifier import (
+    CACHE_DIR,
+    MODEL_NAME,
+    STUDENT_PATH,
+    encode_label_file,
+    load_label_embeddings,
+    softmax,
+)
+from student_encoder import StudentAudioEncoder, save_student
+
+SAMPLE_RATE = 48000
+WINDOW_SAMPLES = 10 * SAMPLE_RATE
+MIN_WINDOW_SAMPLES = 2 * SAMPLE_RATE  # shorter leftovers are dropped
+DATASETS = ["UrbanSounds/UrbanSoundsSamples", "MichielBontenbal/UrbanSoundsII"]
+SAMPLES_FOLDER = "samples"  # recordings made with SAVE_RECORDING = True
+LABEL_EMBEDDINGS_FILE = "label_embeddings.npz"
+TEACHER_CACHE = os.path.join(CACHE_DIR, "teacher_embeddings.npz")
+EPOCHS = 40
+BATCH_SIZE = 16
+LEARNING_RATE = 1e-3
+VALIDATION_SPLIT = 0.2
+SEED = 0
+
+
+def load_recordings():
+    """All recordings as 48 kHz mono float32 arrays"""
+    recordings = []
+    for name in DATASETS:
+        dataset = load_dataset(name, split="train")
+        dataset = dataset.cast_column("audio", Audio(sampling_rate=SAMPLE_RATE))
+        recordings.extend(
+            np.asarray(row["audio"]["array"], dtype=np.float32) for row in dataset
+        )
+    for wav_file in sorted(glob.glob(os.path.join(SAMPLES_FOLDER, "*.wav"))):
+        audio_data, sample_rate = sf.read(wav_file, dtype="float32")
+        if sample_rate == SAMPLE_RATE:
+            recordings.append(audio_data.reshape(len(audio_data), -1)[:, 0])
+    return recordings
+
+
+def split_windows(audio_data):
+    """Cut a recording into 10 s windows, the feature extractor repeat-pads the last one"""
+    return [
+        audio_data[start : start + WINDOW_SAMPLES]
+        for start in range(0, len(audio_data), WINDOW_SAMPLES)
+        if len(audio_data) - start >= MIN_WINDOW_SAMPLES
+    ]
+
+
+def build_teacher_cache():
+    """Compute (and cache) the log-mel features and teacher embeddings of all windows"""
+    if os.path.exists(TEACHER_CACHE):
+        with np.load(TEACHER_CACHE) as cache:
+            return cache["features"], cache["embeddings"]
+    model, processor = clap_torch.load_clap_model(MODEL_NAME)
+    teacher = clap_torch.TorchAudioEncoder(clap_torch.audio_encoder_from_model(model))
+    features, embeddings = [], []
+    for audio_data in load_recordings():
+        for window in split_windows(audio_data):
+            input_features = processor.feature_extractor(
+                window, sampling_rate=SAMPLE_RATE, return_tensors="np"
+            )["input_features"].astype(np.float32)
+            features.append(input_features[0])
+            embeddings.append(teacher(input_features)[0])
+    features, embeddings = np.stack(features), np.stack(embeddings)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    np.savez(TEACHER_CACHE, features=features, embeddings=embeddings)
+    print(f"Teacher embeddings of {len(features)} windows saved to {TEACHER_CACHE}")
+    return features, embeddings
+
+
+def augment(batch):
+    """Random gain, time shift and time/frequency masks on a batch of log-mel features"""
+    batch = batch + torch.empty(len(batch), 1, 1, 1).uniform_(-6.0, 6.0)  # gain in dB
+    batch = torch.roll(batch, shifts=int(torch.randint(0, batch.shape[2], (1,))), dims=2)
+    floor = batch.amin()
+    t0 = int(torch.randint(0, batch.shape[2] - 100, (1,)))
+    f0 = int(torch.randint(0, batch.shape[3] - 8, (1,)))
+    batch[:, :, t0 : t0 + int(torch.randint(0, 100, (1,)))] = floor
+    batch[:, :, :, f0 : f0 + int(torch.randint(0, 8, (1,)))] = floor
+    return batch
+
+
+def distillation_loss(student_embeds, teacher_embeds):
+    """MSE plus cosine distance between normalized embeddings"""
+    cosine = F.cosine_similarity(student_embeds, teacher_embeds, dim=-1)
+    return F.mse_loss(student_embeds, teacher_embeds) + (1 - cosine).mean()
+
+
+def train(student, features, targets):
+    """Train the student on CPU, returns it in eval mode"""
+    optimizer = torch.optim.AdamW(student.parameters(), lr=LEARNING_RATE)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, EPOCHS)
+    features, targets = torch.from_numpy(features), torch.from_numpy(targets)
+    for epoch in range(EPOCHS):
+        student.train()
+        order = torch.randperm(len(features))
+        total = 0.0
+        for start in range(0, len(order), BATCH_SIZE):
+            index = order[start : start + BATCH_SIZE]
+            loss = distillation_loss(student(augment(features[index])), targets[index])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(index)
+        scheduler.step()
+        print(f"Epoch {epoch + 1}/{EPOCHS}: loss {total / len(features):.4f}")
+    return student.eval()
+
+
+def latency_ms(encoder, input_features, runs=5):
+    """Median latency of one window in ms, after one warm-up call"""
+    encoder(input_features)
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        encoder(input_features)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+def compare(student, features, teacher_embeds, label_embeds, logit_scale):
+    """Accuracy and latency of the student against the teacher"""
+    encoder = clap_torch.TorchAudioEncoder(student)
+    student_embeds = np.concatenate(
+        [encoder(features[i : i + BATCH_SIZE]) for i in range(0, len(features), BATCH_SIZE)]
+    )
+    student_scores = softmax(logit_scale * student_embeds @ label_embeds.T)
+    teacher_scores = softmax(logit_scale * teacher_embeds @ label_embeds.T)
+    model = clap_torch.load_audio_encoder(MODEL_NAME)
+    return {
+        "windows": len(features),
+        "mean_cosine": float(np.mean(np.sum(student_embeds * teacher_embeds, axis=1))),
+        "top1_agreement": float(
+            np.mean(student_scores.argmax(axis=1) == teacher_scores.argmax(axis=1))
+        ),
+        "mean_score_delta": float(np.mean(np.abs(student_scores - teacher_scores))),
+        "student_latency_ms": latency_ms(encoder, features[:1]),
+        "teacher_latency_ms": latency_ms(
+            clap_torch.TorchAudioEncoder(model), features[:1]
+        ),
+        "student_parameters": sum(p.numel() for p in student.parameters()),
+        "teacher_parameters": sum(p.numel() for p in model.parameters()),
+    }
+
+
+def main():
+    torch.manual_seed(SEED)
+    labels = sound_scapes.marineterrein_labels
+    features, embeddings = build_teacher_cache()
+
+    saved = load_label_embeddings(LABEL_EMBEDDINGS_FILE, MODEL_NAME, labels)
+    if saved is None:
+        saved = encode_label_file(MODEL_NAME, labels, LABEL_EMBEDDINGS_FILE)
+    label_embeds, logit_scale = saved
+
+    order = np.random.default_rng(SEED).permutation(len(features))
+    n_validation = int(len(order) * VALIDATION_SPLIT)
+    validation, training = order[:n_validation], order[n_validation:]
+    print(f"Training on {len(training)} windows, validating on {len(validation)}")
+
+    student = train(StudentAudioEncoder(), features[training], embeddings[training])
+    report = compare(
+        student, features[validation], embeddings[validation], label_embeds, logit_scale
+    )
+    print(
+        f"Student vs teacher: cosine {report['mean_cosine']:.3f}, "
+        f"top-1 agreement {report['top1_agreement']:.3f}, "
+        f"latency {report['student_latency_ms']:.0f} ms vs "
+        f"{report['teacher_latency_ms']:.0f} ms, "
+        f"{report['student_parameters']:,} vs {report['teacher_parameters']:,} parameters"
+    )
+
+    os.makedirs(os.path.dirname(STUDENT_PATH), exist_ok=True)
+    save_student(student, STUDENT_PATH)
+    with open(STUDENT_PATH + ".json", "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Student saved to {STUDENT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
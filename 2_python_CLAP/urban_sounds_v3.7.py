@@ -0,0 +1,905 @@
+#!/usr/bin/env python
+"""
+Urban sounds classification using CLAP (Contrastive Language-Audio Pre-training) model.
+Real-time audio capture, processing, and MQTT publishing.
+Tested and developed for Python 3.11 and 3.13
+"""
+
+import datetime
+import gc
+import json
+import logging
+import math
+import numpy as np
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from re import findall
+from subprocess import check_output
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.client import CallbackAPIVersion
+import pyaudio
+import requests
+import scipy.io.wavfile as wav
+import sounddevice as sd
+import soundfile as sf
+
+import config
+import sound_scapes
+
+# Set Huggingface tokenizer setting before importing transformers
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+from clap_classifier import EMBEDDING_PCA_PATH, ClapLabelClassifier, load_host_profile, rss_mb
+from activity_gate import ActivityGate, synthetic_result
+from audio_capture import BufferPool, RingBufferCapture
+from fingerprint_cache import FingerprintCache, band_fingerprint
+from inference_worker import InferenceWorker
+from mqtt_spool import SpoolPublisher
+from onset_detector import OnsetDetector
+from payload_codec import ALERT, EVENT, MQTT_OVERHEAD, SUMMARY, WINDOW, EmbeddingPCA, encode_message
+from pipeline_stages import StageGraph, StageStats
+from window_aggregator import WindowAggregator, passes_through
+from event_segmenter import EventSegmenter
+from window_queue import WindowQueue
+from spectral_features import SpectralFeatureStage, StreamingFeatureStage
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Some constants
+DURATION = 10  # duration of each audio recording in seconds 
+SAVE_RECORDING = False # whether to save the recorded audio as .wav files   
+CONTINUOUS_CAPTURE = True  # one open input stream with a ring buffer: no gaps between windows, start times from the stream clock
+CAPTURE_DTYPE = "float32"  # "int16" halves the audio buffer memory (continuous capture only)
+BUFFER_POOL = True  # reuse a fixed set of preallocated audio buffers (continuous capture), False = allocate per window
+QUEUE_SIZE = 6  # windows waiting for classification, at most
+QUEUE_POLICY = "drop_oldest"  # when the queue is full: "block", "drop_oldest", "drop_newest" or "loudness" (drop the quietest)
+RSS_LOG_INTERVAL = 60  # log the process memory every this many windows
+STAGE_WORKERS = 3  # threads for the DSP, CPU temperature and wind speed stages
+BATCHES_IN_FLIGHT = 2  # the DSP of the next batch overlaps with the classification of the current one
+STREAM_HOP = None  # seconds between the starts of overlapping windows, e.g. 2 (continuous capture, multiple of 0.01 s), None = back-to-back windows
+GATE = False  # skip CLAP on silent or low-activity windows and publish "Silence" with the measured levels (activity_gate.py); calibrate OFFSET first
+GATE_MAX_DB_SPL = 35.0  # windows below this level are always gated
+GATE_QUIET_DB_SPL = 45.0  # windows below this level are gated when they are also noise-like:
+GATE_MIN_FLATNESS = 0.3  # spectral flatness at least this (1 = white noise)
+GATE_MAX_BAND_RATIO = 0.5  # and at most this share of the energy in 300 - 8000 Hz
+FINGERPRINT_CACHE = False  # reuse the scores of a near-identical recent window instead of running CLAP (fingerprint_cache.py); such windows are published with cached: 1
+FINGERPRINT_SIMILARITY = 0.99  # cosine similarity of the band-energy fingerprints
+FINGERPRINT_MAX_LEVEL_CHANGE = 3.0  # dB, louder or quieter windows are classified again
+FINGERPRINT_MAX_REUSES = 6  # run CLAP again after this many reuses of one result
+ONSET_ALERTS = False  # detect impulsive onsets on 10 ms frames and publish a fast alert on <topic>/alert (continuous capture; one extra CLAP inference per onset)
+ONSET_THRESHOLD_DB = 15.0  # rise of a 10 ms frame above the background level
+ONSET_MIN_DB_SPL = 70.0  # quieter onsets are ignored
+ONSET_PRE = 0.25  # seconds of audio before the onset in the classified context
+ONSET_POST = 0.75  # seconds after the onset: the alert latency is this plus one inference
+ALERT_LABELS = ("Gunshot", "Slamming door", "Claxon")  # impulsive labels that raise an alert
+ALERT_MIN_SCORE = 0.2  # minimum score of an alert label in the context classification
+OFFSET = 94.0  # offset for dB SPL calculation (to be calibrated based on the microphone sensitivity and recording setup)
+WIND_LAT = 52.372
+WIND_LON = 4.917 
+WIND_UPDATE_INTERVAL = 600  # seconds between OpenWeather calls, to stay under the API rate limit
+OPENWEATHER_API_KEY =config.openweather_api_key
+MODEL_NAME = "laion/larger_clap_general"
+AUDIO_ONLY = True  # free the CLAP text tower after encoding the labels (saves memory on the Pi)
+LABEL_EMBEDDINGS_FILE = "label_embeddings.npz"  # encoded labels, reused at the next start
+CLASSIFIER_BACKEND = "torch"  # "torch", "onnx" (ONNX Runtime, needs onnxruntime) or "student" (run train_student.py first)
+PRECISION = "fp32"  # "fp32", "int8" or "bf16" for the torch backend, run benchmark_precision.py first
+PRECISION_MIN_AGREEMENT = 0.95  # minimum top-1 agreement with fp32 to allow int8 or bf16
+ENGINE = "eager"  # "eager", "torchscript" or "inductor" (torch.compile), compiled once and cached
+BATCH_SIZE = 4  # classify up to this many queued windows in one batch (1 = one window at a time)
+BATCH_MAX_DELAY = 0.0  # seconds to wait for more windows before classifying a partial batch
+INFERENCE_PROCESS = False  # run CLAP in a separate worker process, audio is handed over in shared memory
+INFERENCE_TIMEOUT = 120  # seconds per batch before the worker process is restarted
+NUM_THREADS = None  # torch / ONNX Runtime threads for the model, None = library default
+INTEROP_THREADS = None  # torch inter-op threads, None = library default
+USE_HOST_PROFILE = True  # take backend, threads and batch size from the autotune.py profile of this host
+MQTT_SPOOL = True  # publish through an on-disk store-and-forward spool (mqtt_spool.py), False = publish inline
+MQTT_SPOOL_DIR = os.path.join(os.path.expanduser("~"), ".cache", "urban_sounds", "mqtt_spool")
+MQTT_MAX_INFLIGHT = 20  # QoS 1 messages sent but not yet acknowledged by the broker
+PAYLOAD_FORMAT = "json"  # "json" or "binary" (payload_codec.py, several times smaller; the consumer decodes with the same module)
+PAYLOAD_SPECTROGRAM = False  # add a compressed coarse log-mel image to binary messages (about 4 kB)
+EMBEDDING_UPLINK = False  # add the int8 CLAP audio embedding to binary messages, for re-scoring on the server (rescore_embeddings.py)
+AGGREGATE_INTERVAL = None  # seconds, e.g. 60: publish one summary per interval on <topic>/summary instead of every window; None = every window
+AGGREGATE_PASS_LABELS = ("Alarm", "Claxon", "Gunshot", "Screaming", "Siren", "Slamming door")  # windows with these labels are still published right away
+AGGREGATE_PASS_MIN_SCORE = 0.3  # minimum score of a pass-through label
+EVENTS = False  # merge consecutive windows into events and publish their open and close on <topic>/event instead of every window (event_segmenter.py)
+EVENT_SMOOTHING = 0.5  # weight of the newest window in the smoothed label score
+EVENT_OPEN_SCORE = 0.3  # smoothed score that opens an event...
+EVENT_CLOSE_SCORE = 0.15  # ...and that closes it again (hysteresis)
+EVENT_MIN_WINDOWS = 2  # consecutive windows above EVENT_OPEN_SCORE before an event opens
+EMBEDDING_PCA = True  # reduce the embedding with the fit_embedding_pca.py basis, if it exists (about 140 instead of 520 bytes)
+
+# Settings for and initialization for MQTT
+mqtt_port = 31090
+mqtt_host = config.mqtt_host
+mqtt_user = config.mqtt_user
+mqtt_password = config.mqtt_password
+app_id = "urbansounds"
+dev_id = "OE-007"
+topic = "pipeline/urbansounds/OE-007"
+alert_topic = topic + "/alert"
+summary_topic = topic + "/summary"
+event_topic = topic + "/event"
+# The MQTT client, the spool, the executors, the cache and the gate are created in
+# main(), see initialize_services(): the inference worker is spawned and re-imports
+# this file, and must not recover the spool segments the parent is writing.
+client = None
+spool_publisher = None  # SpoolPublisher when MQTT_SPOOL is set
+
+# Variables for thread communication
+audio_queue = WindowQueue(QUEUE_SIZE, QUEUE_POLICY)  # bounded, see window_queue.py
+recording_active = threading.Event()
+shutdown_event = threading.Event()  # set by SIGINT / SIGTERM, main() then stops the pipeline
+audio_pool = None  # BufferPool of the continuous capture, None = allocate a new array per window
+last_wind_update = None  # time.monotonic() of the last OpenWeather call
+wind_speed = 0.0      # cached wind speed; refreshed every WIND_UPDATE_INTERVAL seconds
+wind_lock = threading.Lock()  # stages of different batches run at the same time
+counter_lock = threading.Lock()
+windows_processed = 0
+next_rss_log = 0
+# Stage executors, created in initialize_services()
+stage_executor = None
+classify_executor = None
+publish_executor = None
+dsp_executor = None
+stage_stats = StageStats()
+uplink_bytes = 0  # payload and MQTT overhead of all published messages
+uplink_start = time.monotonic()
+embedding_pca = None  # EmbeddingPCA of the embedding uplink, loaded in main()
+window_aggregator = None  # WindowAggregator when AGGREGATE_INTERVAL is set, created in main()
+event_segmenter = None  # EventSegmenter when EVENTS is set, created in main()
+stream_state = None  # StreamingState shared by the feature stages when STREAM_HOP is set
+fingerprint_cache = None  # FingerprintCache when FINGERPRINT_CACHE is set
+activity_gate = None  # ActivityGate when GATE is set
+
+
+# FUNCTIONS
+def set_start():
+    """Set the start time of the recording"""
+    start_time = datetime.datetime.now()
+    return start_time
+
+
+def get_cputemp():
+    """Get the CPU temperature of the Raspberry Pi, exception when run on other platforms"""
+    try:
+        temp = check_output(["vcgencmd", "measure_temp"]).decode("UTF-8")
+        return float(findall("\d+\.\d+", temp)[0])
+    except Exception as e:
+        print(f"{e}Cannot get temperature, this code is intended for Raspberry Pi.")
+
+
+def record_audio(duration, output_folder="samples", save_to_file=False, start_time=None):
+    """Records audio for a specified duration and optionally saves it as a .wav file."""
+    # Audio recording constants
+    CHUNK = 1024
+    FORMAT = pyaudio.paInt16
+    CHANNELS = 1
+    SAMPLE_RATE = 48000  # sample rate
+    sample_rate = SAMPLE_RATE
+
+    try:
+        # print("Recording...")
+        audio_data = sd.rec(
+            int(duration * sample_rate),
+            samplerate=SAMPLE_RATE,
+            channels=CHANNELS,
+            dtype="float32",
+        )
+        sd.wait()  # Wait until recording is finished
+    except Exception as e:
+        print(f"Error during audio recording: {e}")
+        return None, None
+
+    # Save to .wav file if save_to_file is True
+    if save_to_file:
+        save_recording(audio_data, sample_rate, start_time, output_folder)
+
+    return sample_rate, audio_data.flatten()
+
+
+def save_recording(audio_data, sample_rate, start_time, output_folder="samples"):
+    """Save a recorded window as a .wav file named after its start time"""
+    # Ensure the output folder exists
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Define the output filename with the output folder
+    WAVE_OUTPUT_FILENAME = start_time.strftime("%Y-%m-%d_%H-%M-%S") + ".wav"
+    WAVE_OUTPUT_FILENAME = os.path.join(output_folder, WAVE_OUTPUT_FILENAME)
+    wav.write(WAVE_OUTPUT_FILENAME, sample_rate, audio_data)
+    print(f"Audio saved to {WAVE_OUTPUT_FILENAME}")
+
+
+def generate_labels_list():
+    """Generate a list of candidate labels"""
+    labels_list = sound_scapes.marineterrein_labels
+    return labels_list
+
+
+def apply_host_profile():
+    """Override the classifier settings with the autotune.py profile of this host"""
+    global CLASSIFIER_BACKEND, NUM_THREADS, INTEROP_THREADS, BATCH_SIZE
+    profile = load_host_profile()
+    if profile is None:
+        print("No host profile found, run autotune.py to create one")
+        return
+    CLASSIFIER_BACKEND = profile["backend"]
+    NUM_THREADS = profile["num_threads"]
+    INTEROP_THREADS = profile["interop_threads"]
+    BATCH_SIZE = profile["batch_size"]
+
+
+def initialize_audio_classifier():
+    """Initialize the zero-shot audio classifier, the labels are encoded once at startup."""
+    classifier_kwargs = dict(
+        model_name=MODEL_NAME,
+        labels=generate_labels_list(),
+        audio_only=AUDIO_ONLY,
+        embeddings_path=LABEL_EMBEDDINGS_FILE,
+        backend=CLASSIFIER_BACKEND,
+        precision=PRECISION,
+        min_agreement=PRECISION_MIN_AGREEMENT,
+        engine=ENGINE,
+        num_threads=NUM_THREADS,
+        interop_threads=INTEROP_THREADS,
+        batch_size=BATCH_SIZE,
+    )
+    if INFERENCE_PROCESS:
+        # Same interface, but the model is loaded in (and can be restarted as) a child process
+        return InferenceWorker(
+            classifier_kwargs,
+            slots=BATCH_SIZE,
+            window_samples=DURATION * 48000,
+            timeout=INFERENCE_TIMEOUT,
+        )
+    return ClapLabelClassifier.from_pretrained(**classifier_kwargs)
+
+
+def audio_classification(audio_classifier, audio_data, labels_list):
+    """Classify an audio file based on a list of candidate labels using the initialized audio classifier."""
+    try:
+        # Perform classification
+        output = audio_classifier(audio_data, candidate_labels=labels_list)
+        return output
+    except Exception as e:
+        print(f"An error occurred during classification: {e}")
+
+
+def audio_classification_batch(audio_classifier, audio_windows, labels_list):
+    """Classify several audio windows in one batch, returns one result per window."""
+    try:
+        return audio_classifier.classify_batch(audio_windows, candidate_labels=labels_list)
+    except Exception as e:
+        print(f"An error occurred during batch classification: {e}")
+
+
+def audio_classification_features(audio_classifier, input_features, is_longer, return_embeddings=False):
+    """Classify windows from the log-mel features of the feature stage, returns one result per window (and the embeddings)."""
+    try:
+        return audio_classifier.classify_features(input_features, is_longer, return_embeddings)
+    except Exception as e:
+        print(f"An error occurred during classification: {e}")
+
+
+def initialize_feature_stages(audio_classifier):
+    """Create one DSP stage per batch in flight, each with its own buffers.
+
+    They use the mel front-end of the classifier (if it has a validated one). A stage
+    goes back into the returned queue when its batch is published, so the DSP of the
+    next batch can run while the model classifies the current one.
+    With STREAM_HOP the stages share one StreamingState, the frames of the last window.
+    """
+    global stream_state
+    frontend = getattr(audio_classifier, "frontend", None)
+    stages = queue.Queue()
+    for _ in range(BATCHES_IN_FLIGHT):
+        if STREAM_HOP:
+            stage = StreamingFeatureStage(round(STREAM_HOP * 48000), frontend and frontend.clone(), compute_mel=frontend is not None, state=stream_state)
+            stream_state = stage.state
+        else:
+            stage = SpectralFeatureStage(frontend and frontend.clone(), compute_mel=frontend is not None)
+        stages.put(stage)
+    return stages
+
+
+def calculate_db_spl(rms_mean):
+    """Calculate dB SPL from RMS values using the formula: db_spl = 20 * np.log10(rms) + OFFSET"""
+    db_spl = 20 * np.log10(rms_mean) + OFFSET
+    #print(f"Calculated dB SPL: {db_spl} dB")
+    return db_spl
+
+
+def get_current_wind_speed():
+    """Fetch the current wind speed from OpenWeather Current Weather API."""
+    if not OPENWEATHER_API_KEY:
+        raise ValueError("OpenWeather API key is not configured.")
+
+    response = requests.get(
+        "https://api.openweathermap.org/data/2.5/weather",
+        params={
+            "lat": WIND_LAT,
+            "lon": WIND_LON,
+            "appid": OPENWEATHER_API_KEY,
+        },
+        timeout=10,
+    )
+    response.raise_for_status()
+
+    weather_data = response.json()
+    print(f"Fetched wind data: {weather_data['wind']['speed']} m/s")
+    return weather_data["wind"]["speed"]
+
+
+def capture_thread():
+    """Thread function for gapless recording: cut windows from one continuous input stream"""
+    sample_rate = 48000
+    hop_samples = round(STREAM_HOP * sample_rate) if STREAM_HOP else None
+    with RingBufferCapture(sample_rate=sample_rate, window_samples=DURATION * sample_rate, dtype=CAPTURE_DTYPE, hop_samples=hop_samples) as capture:
+        print(f"Continuous capture started, a {DURATION} s window every {capture.hop_samples / sample_rate} s")
+        detector = None
+        if ONSET_ALERTS:
+            detector = threading.Thread(target=onset_thread, args=(capture,), name="onset")
+            detector.start()
+        while recording_active.is_set():
+            buffer = None
+            if audio_pool is not None:
+                buffer = audio_pool.acquire(timeout=1)
+                if buffer is None:
+                    continue  # all buffers are queued or being processed
+            window = capture.read_window(timeout=1, out=buffer)
+            if window is None:
+                if buffer is not None:
+                    audio_pool.release(buffer)
+                continue  # check recording_active again
+            start_time, audio_data = window
+            if SAVE_RECORDING:
+                save_recording(audio_data, sample_rate, start_time)
+            audio_queue.put((start_time, audio_data))  # WindowQueue is thread-safe
+        if detector is not None:
+            detector.join()
+    print(f"Continuous capture stopped ({capture.input_overflows} input overflows, {capture.lost_samples} samples lost)")
+
+
+def recording_thread():
+    """Thread function for continuous audio recording"""
+    if CONTINUOUS_CAPTURE:
+        try:
+            capture_thread()
+            return
+        except Exception as e:
+            print(f"Error in continuous capture: {e}, falling back to sd.rec recording")
+    while recording_active.is_set():
+        print("start recording thread")
+        try:
+            start_time = set_start()
+            sample_rate, audio_data = record_audio(
+                duration=DURATION, save_to_file=SAVE_RECORDING, start_time=start_time
+            )
+            if audio_data is None:
+                shutdown_event.wait(1)  # recording failed, do not spin on a broken audio device
+                continue
+            audio_queue.put((start_time, audio_data))  # WindowQueue is thread-safe
+        except Exception as e:
+            print(f"Error in recording thread: {e}")
+            shutdown_event.wait(1)  # do not spin on a broken audio device
+        print("recording thread completed")
+
+
+def onset_thread(capture):
+    """Thread: follow the capture ring on 10 ms frames and publish an alert for impulsive onsets"""
+    sample_rate = capture.sample_rate
+    detector = OnsetDetector(sample_rate=sample_rate, threshold_db=ONSET_THRESHOLD_DB, min_level_db=ONSET_MIN_DB_SPL - OFFSET)
+    block = np.empty(sample_rate // 10, dtype=capture.dtype)  # detection latency of at most 100 ms
+    # Own front-end buffers: the alert runs next to the window classification
+    frontend = getattr(audio_classifier, "frontend", None)
+    frontend = frontend and frontend.clone()
+    cursor = capture.written
+    while recording_active.is_set():
+        if not capture.wait_for(cursor + len(block), timeout=1):
+            continue
+        if capture.read_samples(cursor, len(block), out=block) is None:
+            cursor = capture.written - len(block)  # fell a ring behind during an alert
+            continue
+        onsets = detector.process(block, cursor)
+        cursor += len(block)
+        for onset, level in onsets:
+            try:
+                classify_onset(capture, onset, level, frontend)
+            except Exception as e:
+                print(f"Error classifying onset: {e}")
+    print(f"Onset detector stopped ({detector.onsets} onsets)")
+
+
+def classify_onset(capture, onset, level, frontend):
+    """Classify a short context around an onset and publish an alert if it is an impulsive sound"""
+    first = max(onset - int(ONSET_PRE * capture.sample_rate), 0)
+    end = onset + int(ONSET_POST * capture.sample_rate)
+    if not capture.wait_for(end, timeout=ONSET_POST + 1):
+        return
+    context = capture.read_samples(first, end - first)
+    if context is None:
+        return
+    # The model runs one call at a time on classify_executor, so the alert waits for
+    # the current batch instead of competing with it for the CPU (or the worker process)
+    if frontend is not None:
+        # Repeat-padded to a full window like the CLAP feature extractor does
+        input_features, is_longer = frontend(context)
+        results = classify_executor.submit(audio_classification_features, audio_classifier, input_features, is_longer).result()
+        result = results[0] if results is not None else None
+    else:
+        result = classify_executor.submit(audio_classification, audio_classifier, float_samples(context), labels_list).result()
+    if result is None:
+        return
+    alert = max((item for item in result if item["label"] in ALERT_LABELS), key=lambda item: item["score"], default=None)
+    onset_time = capture.window_start_time(onset)
+    print(f"Onset at {onset_time} ({level + OFFSET:.0f} dB): {result[0]['label']} {result[0]['score']:.3f}")
+    if alert is None or alert["score"] < ALERT_MIN_SCORE:
+        return
+
+    alert_dict = {item["label"]: item["score"] for item in result[:5]}
+    alert_dict["alert"] = alert["label"]
+    alert_dict["onset"] = round(onset_time.timestamp(), 3)
+    alert_dict["db_spl"] = level + OFFSET  # 10 ms frame at the onset
+    alert_dict["latency"] = round(time.time() - onset_time.timestamp(), 2)
+    publish_message(alert_topic, encode_mqtt_message(alert_dict, ALERT))
+    print(f"Alert {alert['label']} published {alert_dict['latency']} s after the onset")
+
+
+def float_samples(audio_data):
+    """float32 samples for the classifier, also for int16 capture"""
+    if audio_data.dtype == np.int16:
+        return audio_data.astype(np.float32) / 32768
+    return audio_data
+
+
+def get_audio_batch(max_size, max_delay):
+    """Get up to max_size windows from the queue, waiting at most max_delay seconds for more"""
+    batch = [audio_queue.get()]  # blocks until a window arrives or the queue is closed
+    deadline = time.monotonic() + max_delay
+    while len(batch) < max_size:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining > 0:
+                batch.append(audio_queue.get(timeout=remaining))
+            else:
+                batch.append(audio_queue.get_nowait())  # only drain the backlog
+        except queue.Empty:
+            break
+    return batch
+
+
+def update_wind_speed():
+    """Refresh the cached wind speed every WIND_UPDATE_INTERVAL seconds, returns the current value"""
+    global last_wind_update, wind_speed
+    with wind_lock:
+        # By time rather than by window count: with STREAM_HOP there are more windows per minute
+        now = time.monotonic()
+        if last_wind_update is None or now - last_wind_update >= WIND_UPDATE_INTERVAL:
+            last_wind_update = now
+            try:
+                wind_speed = get_current_wind_speed()
+                print(f"Wind speed updated: {wind_speed} m/s")
+            except Exception as e:
+                print(f"Error fetching wind speed: {e}")
+        return wind_speed
+
+
+def process_window(start_time, features, result, RPI_temp, wind_speed, gated=False, embedding=None, cached=False):
+    """Analyse one classified window and send the mqtt message"""
+    print(f"""Classifications: {result[0]['label']}: {round(result[0]['score'],5)} | {result[1]['label']}: {round(result[1]['score'],5)} | {result[2]['label']}: {round(result[2]['score'],5)} | {result[3]['label']}: {round(result[3]['score'],5)} | {result[4]['label']}: {round(result[4]['score'],5)}""")
+    total = result[0]['score'] + result[1]['score'] + result[2]['score'] + result[3]['score'] + result[4]['score']
+    print(f"Total score: {total}")
+
+    # Analyse audio (computed once per window in the feature stage)
+    ptp_value = features.ptp
+
+    # add the start_time to the mqtt message as unixtime
+    unix_time = int(time.mktime(start_time.timetuple()))
+
+    #Get RMS Energy and dB SPL
+    rms_mean = features.rms_mean
+    db_spl = calculate_db_spl(rms_mean)
+
+    # Create a dictionary for the MQTT message
+    mqtt_dict = {}
+    for i, result_item in enumerate(result[:5]):  # Limit to top 5
+        mqtt_dict[result_item["label"]] = result_item["score"]
+    # Add additional data to the dictionary
+    mqtt_dict["start_recording"] = unix_time
+    mqtt_dict["RPI_temp"] = RPI_temp
+    mqtt_dict["ptp"] = ptp_value
+    mqtt_dict["rms"] = rms_mean
+    mqtt_dict["db_spl"] = db_spl
+    print(f"db measured: {mqtt_dict['db_spl']}")
+    #mqtt_dict["spectrogram"] = features.spectrogram.tolist()  # Maybe later in the project (when we'll start data analysis)
+    mqtt_dict["wind_speed"] = wind_speed
+    mqtt_dict["gated"] = int(gated)  # 1 = CLAP skipped, the scores are the synthetic "Silence" result
+    mqtt_dict["cached"] = int(cached)  # 1 = CLAP skipped, the scores of a near-identical earlier window
+    # Backlog of the sensor: a growing queue_lag or dropped count means it no longer keeps up
+    queue_stats = audio_queue.stats()
+    mqtt_dict["queue_depth"] = queue_stats["depth"]
+    mqtt_dict["queue_lag"] = round(queue_stats["oldest_age"], 1)
+    mqtt_dict["dropped_windows"] = queue_stats["dropped"]
+       
+
+    # Convert all float32 values in mqtt_dict to native Python float
+    mqtt_dict = {
+        key: float(value) if isinstance(value, np.float32) else value
+        for key, value in mqtt_dict.items()
+    }
+
+    # Create the MQTT message and convert to JSON (or the binary format)
+    spectrogram = None
+    if PAYLOAD_SPECTROGRAM and features.input_features is not None:
+        spectrogram = features.input_features[0]  # (frames, mel bands) in dB
+    if not EMBEDDING_UPLINK:
+        embedding = None
+    if event_segmenter is not None:
+        for event_fields in event_segmenter.add(unix_time, result, db_spl):
+            publish_event(event_fields)
+    if window_aggregator is not None:
+        summary = window_aggregator.add(unix_time, result, mqtt_dict, embedding)
+        if summary is not None:
+            publish_summary(*summary)
+        if not passes_through(result, AGGREGATE_PASS_LABELS, AGGREGATE_PASS_MIN_SCORE):
+            return  # only part of the interval summary
+    elif event_segmenter is not None:
+        return  # only part of the events
+    msg_str = encode_mqtt_message(mqtt_dict, WINDOW, spectrogram, embedding)
+    # print(msg_str)
+    publish_message(topic, msg_str)
+
+
+def publish_summary(summary_fields, embedding):
+    """Send the summary of one aggregation interval"""
+    publish_message(summary_topic, encode_mqtt_message(summary_fields, SUMMARY, embedding=embedding))
+    print(f"Summary of {summary_fields['windows']} window(s) from {datetime.datetime.fromtimestamp(summary_fields['interval_start'])} published")
+
+
+def publish_event(event_fields):
+    """Send the open or close of one event"""
+    publish_message(event_topic, encode_mqtt_message(event_fields, EVENT))
+    print(f"Event {event_fields['event_id']} {event_fields['event']} {event_fields['state']}")
+
+
+def encode_mqtt_message(payload_fields, kind, spectrogram=None, embedding=None):
+    """The message as a JSON string, or as bytes with PAYLOAD_FORMAT = "binary" (no spectrogram or embedding in JSON)"""
+    message_time = int(time.time() * 1000)
+    if PAYLOAD_FORMAT == "binary":
+        # app_id and dev_id are implied by the topic
+        return encode_message(payload_fields, message_time, kind, labels_list, spectrogram, embedding, embedding_pca)
+    mqtt_message = {
+        "app_id": app_id,
+        "dev_id": dev_id,
+        "payload_fields": payload_fields,
+        "time": message_time,
+    }
+    return json.dumps(mqtt_message)
+
+
+def publish_message(message_topic, msg_str):
+    """Send one mqtt message, reconnecting first if the connection is down
+
+    With the spool the message is only handed over: it is written to disk and sent
+    by the spool threads, paho reconnects in the background.
+    """
+    global uplink_bytes
+    with counter_lock:
+        uplink_bytes += len(msg_str) + len(message_topic) + MQTT_OVERHEAD
+    if spool_publisher is not None:
+        spool_publisher.publish(message_topic, msg_str)
+        return
+    try:
+        # Check if the client is connected
+        if client.is_connected():
+            client.publish(message_topic, msg_str)
+            print("Connection up & MQTT message sent successfully")
+        else:
+            client.reconnect()
+            client.publish(message_topic, msg_str)
+            print("MQTT message sent after reconnection")
+    except Exception as e:
+        print(f"Unexpected error while publishing MQTT message: {e}")
+
+
+def gate_stage(context):
+    """Stage: decide per window whether CLAP has to run, returns one flag per window (True = skip)"""
+    features, _, _ = context["features"]
+    if activity_gate is None:
+        return [False] * len(features)
+    return [activity_gate.check(window_features.power, calculate_db_spl(window_features.rms_mean))[0] for window_features in features]
+
+
+def classify_stage(context):
+    """Stage: classify the windows of a batch that passed the gate, from the mel of the feature stage if possible
+
+    Windows that match a recent window in the fingerprint cache reuse its result.
+    Returns (results, embeddings, cached); the embedding is None for gated windows
+    and when the classifier runs in the worker process, cached is True for the
+    windows that reused a result.
+    """
+    features, input_features, is_longer = context["features"]
+    gated = context["gate"]
+    results = [synthetic_result(labels_list) if skip else None for skip in gated]
+    window_embeddings = [None] * len(features)
+    cached = [False] * len(features)
+    lookups = {}  # window index -> (fingerprint, cache entry to refresh or None)
+    for i, skip in enumerate(gated):
+        if not skip and fingerprint_cache is not None:
+            fingerprint = band_fingerprint(features[i].power)
+            entry, reuse = fingerprint_cache.lookup(fingerprint)
+            if reuse:
+                results[i] = entry.result
+                window_embeddings[i] = entry.embedding
+                cached[i] = True
+            else:
+                lookups[i] = (fingerprint, entry)
+    active = [i for i, result in enumerate(results) if result is None]
+    if not active:
+        return results, window_embeddings, cached
+    embeddings = None
+    if input_features is not None:
+        if len(active) < len(features):
+            input_features, is_longer = input_features[active], is_longer[active]
+        classified = audio_classification_features(audio_classifier, input_features, is_longer, return_embeddings=True)
+        active_results, embeddings = classified if classified is not None else (None, None)
+    else:
+        # float32 samples also for int16 capture
+        samples = [features[i].samples for i in active]
+        if len(samples) == 1:
+            active_results = [audio_classification(audio_classifier, samples[0], labels_list)]
+        else:
+            active_results = audio_classification_batch(audio_classifier, samples, labels_list)
+    if active_results is None or None in active_results:
+        raise RuntimeError("audio classification failed")
+    for n, (i, result) in enumerate(zip(active, active_results)):
+        results[i] = result
+        if embeddings is not None:
+            window_embeddings[i] = embeddings[n]
+        if i in lookups:
+            fingerprint, entry = lookups[i]
+            fingerprint_cache.store(fingerprint, result, window_embeddings[i], replaces=entry)
+    return results, window_embeddings, cached
+
+
+def publish_stage(context):
+    """Stage: build and send the mqtt message of every window in the batch"""
+    features, _, _ = context["features"]
+    results, embeddings, cached = context["classification"]
+    for (start_time, _), window_features, result, embedding, gated, reused in zip(context["batch"], features, results, embeddings, context["gate"], cached):
+        process_window(start_time, window_features, result, context["telemetry"], context["wind"], gated, embedding, reused)
+
+
+def build_stage_graph():
+    """Declare the per-batch stages; independent stages run at the same time"""
+    graph = StageGraph(stage_executor)
+    # DSP: one FFT pass per window for ptp, rms, spectrogram and the CLAP mel
+    graph.add("features", lambda context: context["feature_stage"]([audio_data for _, audio_data in context["batch"]]), executor=dsp_executor if STREAM_HOP else None)
+    graph.add("telemetry", lambda context: get_cputemp())
+    graph.add("wind", lambda context: update_wind_speed())
+    # The gate, the model and the publish each run one batch at a time, in order
+    graph.add("gate", gate_stage, deps=("features",), executor=classify_executor, ordered=True)
+    graph.add("classification", classify_stage, deps=("features", "gate"), executor=classify_executor, ordered=True)
+    graph.add("publish", publish_stage, deps=("features", "gate", "classification", "telemetry", "wind"), executor=publish_executor, ordered=True)
+    return graph
+
+
+def batch_done(run, batch, feature_stage):
+    """Called when the publish stage of a batch has finished (or was skipped after an error)"""
+    global windows_processed, next_rss_log
+    error = run.futures["publish"].exception()
+    if error is not None:
+        print(f"Error processing batch: {error}")
+    timings = ", ".join(f"{name} {seconds:.2f} s" for name, seconds in run.timings.items())
+    print(f"Processed {len(batch)} window(s) in {run.elapsed():.2f} s ({timings})")
+
+    if audio_pool is not None:
+        for _, audio_data in batch:
+            audio_pool.release(audio_data)  # the buffer can be recorded into again
+    feature_stages.put(feature_stage)  # its buffers can be used for the next batch
+
+    if audio_pool is None:
+        # Clean the memory (with the buffer pool the steady state does not allocate audio)
+        gc.collect()
+        #print("garbage collected")
+    with counter_lock:
+        windows_processed += len(batch)
+        stage_stats.add(run, len(batch))
+        if windows_processed >= next_rss_log:
+            print(f"RSS after {windows_processed} windows: {rss_mb():.0f} MB")
+            report_sustainable_hop()
+            if activity_gate is not None:
+                gate_stats = activity_gate.stats()
+                print(f"Gate: {gate_stats['hit_rate']:.0%} of {gate_stats['windows']} windows skipped CLAP ({gate_stats['silent']} silent, {gate_stats['low_activity']} low activity)")
+            uplink_hours = (time.monotonic() - uplink_start) / 3600
+            print(f"Uplink: {uplink_bytes / 1e3:.0f} kB in {uplink_hours:.2f} h, {uplink_bytes / uplink_hours * 24 / 1e6:.2f} MB per day with MQTT and TCP/IP overhead")
+            if spool_publisher is not None:
+                spool_stats = spool_publisher.stats()
+                print(f"MQTT spool: {spool_stats['acked']} of {spool_stats['sent']} sent messages acknowledged, {spool_stats['inflight']} in flight, {spool_stats['resent']} resent")
+            if fingerprint_cache is not None:
+                cache_stats = fingerprint_cache.stats()
+                print(f"Fingerprint cache: {cache_stats['reuse_ratio']:.0%} of {cache_stats['windows']} windows reused a result, {cache_stats['refreshed']} refreshes with score drift {cache_stats['mean_drift']:.3f} mean, {cache_stats['max_drift']:.3f} max")
+            next_rss_log += RSS_LOG_INTERVAL
+
+
+def report_sustainable_hop():
+    """Print the shortest STREAM_HOP this CPU keeps up with, from the measured stage times
+
+    The features, classification and publish stages each run one batch at a time
+    on their own thread, so the slowest of them sets the window rate.
+    """
+    name, seconds = stage_stats.bottleneck(("features", "classification", "publish"))
+    if name is None:
+        return
+    hop = math.ceil(seconds * 100) / 100  # the hop is a multiple of the 10 ms STFT hop
+    message = f"Sustainable hop: {hop:.2f} s ({name} {seconds:.2f} s per window)"
+    if STREAM_HOP:
+        message += f", configured {STREAM_HOP} s" + (" - too short, windows will be dropped" if STREAM_HOP < hop else "")
+        message += f", {stream_state.reuse_ratio():.0%} of the STFT frames reused"
+    print(message)
+
+
+def processing_thread():
+    """Thread that starts the stage graph (classification, DSP, telemetry, mqtt) for each batch"""
+    while recording_active.is_set():
+        try:
+            try:
+                batch = get_audio_batch(BATCH_SIZE, BATCH_MAX_DELAY)
+                for start_time, _ in batch:
+                    print(f"processing sample with start time: {start_time}")
+            except queue.Empty:
+                continue  # the queue was closed for shutdown
+
+            # Waits while BATCHES_IN_FLIGHT batches are being processed
+            feature_stage = feature_stages.get()
+            queue_stats = audio_queue.stats()
+            print(f"start processing {len(batch)} window(s), {queue_stats['depth']} left in queue (oldest {queue_stats['oldest_age']:.1f} s), {queue_stats['dropped']} dropped so far")
+            run = stage_graph.run(batch=batch, feature_stage=feature_stage)
+            run.futures["publish"].add_done_callback(
+                lambda _, run=run, batch=batch, feature_stage=feature_stage: batch_done(run, batch, feature_stage)
+            )
+
+        except Exception as e:
+            print(f"Error in processing thread: {e}")
+            shutdown_event.wait(1)  # do not spin on a persistent error
+
+    # Wait for the batches in flight before the executors shut down
+    for _ in range(BATCHES_IN_FLIGHT):
+        feature_stages.get()
+
+
+def request_shutdown(signum, frame):
+    """Signal handler for SIGINT and SIGTERM: let main() stop the pipeline"""
+    print(f"\nReceived {signal.Signals(signum).name}, stopping...")
+    shutdown_event.set()
+
+
+def stop_pipeline(threads):
+    """Stop capture and processing, wait for the threads, then close MQTT and the worker"""
+    print("Stopping threads...")
+    recording_active.clear()
+    audio_queue.close()  # wakes up the processing thread
+    for thread in threads:
+        thread.join()
+    if window_aggregator is not None:
+        summary = window_aggregator.flush()  # the last, partial interval
+        if summary is not None:
+            publish_summary(*summary)
+    if event_segmenter is not None:
+        for event_fields in event_segmenter.close_all():  # events still open at shutdown
+            publish_event(event_fields)
+    if spool_publisher is not None:
+        spool_publisher.stop()  # unsent messages stay in the spool for the next start
+    client.loop_stop()
+    client.disconnect()
+    for executor in (stage_executor, dsp_executor, classify_executor, publish_executor):
+        executor.shutdown()
+    if INFERENCE_PROCESS:
+        audio_classifier.close()
+    print("Threads stopped successfully")
+
+
+def initialize_services():
+    """Create the MQTT client, the spool, the stage executors, the fingerprint cache and the gate"""
+    global client, spool_publisher, stage_executor, classify_executor, publish_executor, dsp_executor, fingerprint_cache, activity_gate
+    # client = mqtt.Client()  # solving broken pipe issue
+    client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
+    client.username_pw_set(mqtt_user, mqtt_password)
+    if MQTT_SPOOL:
+        spool_publisher = SpoolPublisher(client, MQTT_SPOOL_DIR, max_inflight=MQTT_MAX_INFLIGHT)
+    # Stage executors: DSP, CPU temperature and wind speed share a small pool, the model
+    # and the mqtt publish each have one thread so batches stay in order
+    stage_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="stage")
+    classify_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classify")
+    publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="publish")
+    # Streaming reuses the STFT frames of the previous window, so its DSP runs in order
+    dsp_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dsp")
+    if FINGERPRINT_CACHE:
+        fingerprint_cache = FingerprintCache(threshold=FINGERPRINT_SIMILARITY, max_level_change=FINGERPRINT_MAX_LEVEL_CHANGE, max_reuses=FINGERPRINT_MAX_REUSES)
+    if GATE:
+        activity_gate = ActivityGate(GATE_MAX_DB_SPL, GATE_QUIET_DB_SPL, GATE_MIN_FLATNESS, max_band_ratio=GATE_MAX_BAND_RATIO)
+
+
+def main():
+    try:
+        initialize_services()
+        # Initialize the audio classifier and load the labels
+        global audio_classifier, labels_list, feature_stages, stage_graph, audio_pool, embedding_pca, window_aggregator, event_segmenter
+        if USE_HOST_PROFILE:
+            apply_host_profile()
+        audio_classifier = initialize_audio_classifier()
+        feature_stages = initialize_feature_stages(audio_classifier)
+        stage_graph = build_stage_graph()
+        labels_list = generate_labels_list()
+        if EMBEDDING_UPLINK and EMBEDDING_PCA and os.path.exists(EMBEDDING_PCA_PATH):
+            embedding_pca = EmbeddingPCA.load(EMBEDDING_PCA_PATH)
+            print(f"Embedding uplink reduced to {len(embedding_pca.components)} PCA components")
+        if AGGREGATE_INTERVAL:
+            window_aggregator = WindowAggregator(labels_list, AGGREGATE_INTERVAL)
+        if EVENTS:
+            event_segmenter = EventSegmenter(
+                labels_list,
+                DURATION,
+                EVENT_SMOOTHING,
+                EVENT_OPEN_SCORE,
+                EVENT_CLOSE_SCORE,
+                EVENT_MIN_WINDOWS,
+                max_gap_s=2 * (STREAM_HOP or DURATION),
+            )
+        audio_classifier.warm_up()  # compile/load kernels before the first real window
+        if CONTINUOUS_CAPTURE and BUFFER_POOL:
+            # Enough buffers for a full queue, the batch in processing and the window being recorded
+            audio_pool = BufferPool(QUEUE_SIZE + BATCHES_IN_FLIGHT * BATCH_SIZE + 1, DURATION * 48000, CAPTURE_DTYPE)
+            audio_queue.on_drop = lambda window: audio_pool.release(window[1])
+            # Steady state: no gc.collect per window; keep the model and startup
+            # objects out of the collector's generations
+            gc.collect()
+            gc.freeze()
+
+        # Connect to MQTT client
+        if spool_publisher is not None:
+            # The network loop keeps reconnecting by itself, also when the broker is down at startup
+            client.reconnect_delay_set(min_delay=1, max_delay=120)
+            client.connect_async(mqtt_host, keepalive=300)
+            client.loop_start()
+            spool_publisher.start()
+            print("MQTT loop and spool started")
+        else:
+            try:
+                client.connect(mqtt_host, keepalive=300)
+                client.loop_start()  # Start the MQTT network loop
+                print("Connected to MQTT broker and loop started")
+            except:
+                pass
+        #except mqtt.MQTTException as e:
+        #    print(f"MQTT connection error: {e}")
+
+        # Create and start threads
+        recording_active.set()
+        recorder = threading.Thread(target=recording_thread)
+        processor = threading.Thread(target=processing_thread)
+
+        # Start threads
+        signal.signal(signal.SIGINT, request_shutdown)
+        signal.signal(signal.SIGTERM, request_shutdown)
+        recorder.start()
+        processor.start()
+
+        # Sleep without using CPU until SIGINT or SIGTERM
+        shutdown_event.wait()
+        stop_pipeline([recorder, processor])
+
+    except KeyboardInterrupt:
+        print("\nStopped during startup")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+On-device aggregation of classified windows into per-interval summaries.
+
+One message per 10 s window is 8,640 messages per sensor per day, most of them
+"Noise" or "Car". The aggregator collects the windows of a wall-clock interval
+(one minute by default) and emits one summary when the next interval starts:
+- per label: how often it was the top label, its mean and max score,
+- min / mean / max of db_spl, ptp and rms,
+- the number of windows (and gated windows) and the latest telemetry,
+- the normalized mean audio embedding, when the windows have one.
+Labels that never scored min_score are left out. Memory is constant: running
+sums per label and per level, whatever the interval.
+
+Windows with a pass-through label (alerts) are still published one by one by the
+caller, see passes_through().
+"""
+
+import numpy as np
+
+LEVEL_FIELDS = ("db_spl", "ptp", "rms")
+LAST_FIELDS = ("RPI_temp", "wind_speed", "queue_depth", "queue_lag", "dropped_windows")
+
+
+class RunningStats:
+    """Min, mean and max of a stream of values."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def add(self, value):
+        if value is None or not np.isfinite(value):
+            return  # e.g. -inf dB of a window of digital silence
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+
+    def summary(self, name):
+        if not self.count:
+            return {}
+        return {
+            f"{name}_min": self.minimum,
+            f"{name}_mean": self.total / self.count,
+            f"{name}_max": self.maximum,
+        }
+
+
+class WindowAggregator:
+    """Running per-interval statistics of classified windows."""
+
+    def __init__(self, labels, interval_s=60, min_score=0.01):
+        self.labels = list(labels)
+        self.label_index = {label: i for i, label in enumerate(self.labels)}
+        self.interval = int(interval_s)
+        self.min_score = min_score
+        self.start = None
+        self.reset(None)
+
+    def reset(self, start):
+        self.start = start
+        self.windows = 0
+        self.gated = 0
+        self.top_counts = np.zeros(len(self.labels), dtype=np.int64)
+        self.score_sum = np.zeros(len(self.labels))
+        self.score_max = np.zeros(len(self.labels))
+        self.levels = {name: RunningStats() for name in LEVEL_FIELDS}
+        self.last = {}
+        self.embedding_sum = None
+
+    def add(self, unix_time, result, fields, embedding=None):
+        """Add one window, returns the summary of the previous interval when this one starts a new interval
+
+        result is the ranked result of all labels, fields the payload_fields of the
+        window message (db_spl, ptp, rms, telemetry).
+        """
+        start = int(unix_time) - int(unix_time) % self.interval
+        summary = None
+        if self.start is None or start > self.start:
+            summary = self.flush()
+            self.reset(start)
+        self.windows += 1
+        self.gated += int(fields.get("gated", 0))
+        scores = np.zeros(len(self.labels))
+        for item in result:
+            if item["label"] in self.label_index:
+                scores[self.label_index[item["label"]]] = item["score"]
+        if result and result[0]["label"] in self.label_index:
+            self.top_counts[self.label_index[result[0]["label"]]] += 1
+        self.score_sum += scores
+        np.maximum(self.score_max, scores, out=self.score_max)
+        for name in LEVEL_FIELDS:
+            self.levels[name].add(fields.get(name))
+        self.last.update({name: fields[name] for name in LAST_FIELDS if name in fields})
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float64)
+            self.embedding_sum = embedding if self.embedding_sum is None else self.embedding_sum + embedding
+        return summary
+
+    def flush(self):
+        """(payload_fields, mean embedding or None) of the current interval, None if it is empty"""
+        if not self.windows:
+            return None
+        label_stats = {
+            label: {
+                "count": int(self.top_counts[i]),
+                "mean": float(self.score_sum[i] / self.windows),
+                "max": float(self.score_max[i]),
+            }
+            for i, label in enumerate(self.labels)
+            if self.top_counts[i] or self.score_max[i] >= self.min_score
+        }
+        fields = {
+            "interval_start": self.start,
+            "interval": self.interval,
+            "windows": self.windows,
+            "gated_windows": self.gated,  # a count, "gated" is the flag of one window
+            "labels": dict(sorted(label_stats.items(), key=lambda item: -item[1]["mean"])),
+        }
+        for name, stats in self.levels.items():
+            fields.update(stats.summary(name))
+        fields.update(self.last)
+        embedding = None
+        if self.embedding_sum is not None:
+            embedding = self.embedding_sum / max(np.linalg.norm(self.embedding_sum), 1e-12)
+            embedding = embedding.astype(np.float32)
+        self.windows = 0  # a second flush of the same interval returns None
+        return fields, embedding
+
+
+def passes_through(result, labels, min_score):
+    """True when one of labels scores at least min_score: publish the window right away"""
+    return any(item["label"] in labels and item["score"] >= min_score for item in result)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Bounded queue of audio windows with a backpressure policy and lag statistics.
+
+When inference is slower than real time (thermal throttling, a model swap, an
+MQTT reconnect stall), an unbounded queue keeps growing and the published results
+fall further behind. This queue holds at most maxsize windows. When it is full, the
+policy decides:
+- "block": the producer waits for space (the capture ring buffer then drops audio),
+- "drop_oldest": the oldest queued window is dropped, results stay close to real time,
+- "drop_newest": the new window is dropped, the queued windows are kept,
+- "loudness": the quietest window (queued or new) is dropped, so loud events survive.
+Windows always come out in recording order.
+
+stats() reports the depth, the age of the oldest window and the drop counts.
+"""
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+POLICIES = ("block", "drop_oldest", "drop_newest", "loudness")
+
+
+def loudness(audio_data):
+    """RMS of a window in its own sample units, only used to compare windows
+
+    Computed in place: float windows with one dot product, int16 windows with a
+    float64 einsum that casts in small buffered chunks instead of copying the window.
+    """
+    audio_data = audio_data.reshape(-1)  # (samples, 1) from sd.rec, a view
+    if audio_data.dtype.kind == "f":
+        energy = np.dot(audio_data, audio_data)
+    else:
+        energy = np.einsum("i,i->", audio_data, audio_data, dtype=np.float64, casting="unsafe")
+    return float(np.sqrt(energy / max(len(audio_data), 1)))
+
+
+class WindowQueue:
+    """Thread-safe bounded FIFO of (start_time, audio_data) windows."""
+
+    def __init__(self, maxsize=6, policy="drop_oldest", on_drop=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, choose from {POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop  # called with every dropped window, e.g. to reuse its buffer
+        self.items = collections.deque()  # (enqueue time, loudness, window)
+        self.condition = threading.Condition()
+        self.dropped = {"oldest": 0, "newest": 0, "quietest": 0}
+        self.put_count = 0
+        self.max_depth = 0
+        self.closed = False
+
+    def put(self, window, timeout=None):
+        """Add a window, returns False when it was dropped instead"""
+        level = loudness(window[1]) if self.policy == "loudness" else 0.0
+        dropped = None
+        with self.condition:
+            self.put_count += 1
+            if len(self.items) >= self.maxsize:
+                if self.policy == "block":
+                    self.condition.wait_for(
+                        lambda: len(self.items) < self.maxsize or self.closed, timeout
+                    )
+                    if len(self.items) >= self.maxsize:
+                        self.dropped["newest"] += 1
+                        dropped = window
+                elif self.policy == "drop_oldest":
+                    self.dropped["oldest"] += 1
+                    dropped = self.items.popleft()[2]
+                elif self.policy == "drop_newest":
+                    self.dropped["newest"] += 1
+                    dropped = window
+                else:
+                    quietest = min(range(len(self.items)), key=lambda i: self.items[i][1])
+                    self.dropped["quietest"] += 1
+                    if self.items[quietest][1] < level:
+                        dropped = self.items[quietest][2]
+                        del self.items[quietest]
+                    else:
+                        dropped = window
+            if dropped is not window:
+                self.items.append((time.monotonic(), level, window))
+                self.max_depth = max(self.max_depth, len(self.items))
+                self.condition.notify_all()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+        return dropped is not window
+
+    def get(self, timeout=None):
+        """Remove and return the oldest window, raises queue.Empty after timeout
+
+        Also raises queue.Empty when the queue is closed and empty, so a consumer
+        blocked without timeout wakes up at shutdown.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.items or self.closed, timeout)
+            if not self.items:
+                raise queue.Empty
+            window = self.items.popleft()[2]
+            self.condition.notify_all()
+            return window
+
+    def get_nowait(self):
+        """Remove and return the oldest window, raises queue.Empty if there is none"""
+        return self.get(timeout=0)
+
+    def close(self):
+        """Wake up all waiting consumers and producers, for shutdown"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def qsize(self):
+        return len(self.items)
+
+    def stats(self):
+        """Depth, age of the oldest window in seconds and drop counts"""
+        with self.condition:
+            oldest_age = time.monotonic() - self.items[0][0] if self.items else 0.0
+            return {
+                "depth": len(self.items),
+                "max_depth": self.max_depth,
+                "oldest_age": oldest_age,
+                "windows": self.put_count,
+                "dropped": sum(self.dropped.values()),
+                **{f"dropped_{reason}": count for reason, count in self.dropped.items()},
+            }